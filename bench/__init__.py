@@ -0,0 +1,7 @@
+"""
+Micro-benchmarks for the bytelynx hot paths.
+
+Each module is runnable on its own from the repo root::
+
+    python3 -m bench.hash_ops
+"""
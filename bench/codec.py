@@ -0,0 +1,205 @@
+"""
+Encode / decode throughput of every message in the protocol.
+
+Each message is run through the compiled codecs that the stack uses
+(:func:`~net.prototree.Protocol.encode` / :func:`~net.prototree.Protocol.decode`)
+and through the interpreted tree walk they replaced
+(:func:`bench.treecodec.encode` / :func:`bench.treecodec.decode`,
+protocol version 1 only),
+on DHT sized sample data: full length hashes and K node responses.
+With ``--versions`` every protocol version is run through the compiled
+codecs instead, along with the bytes and time each version spends on
+:attr:`TRAFFIC`.
+
+::
+
+    python3 -m bench.codec
+    python3 -m bench.codec --versions
+"""
+import argparse
+import os
+import sys
+from time import perf_counter
+
+from common import Address, Contact, Hash
+from kademlia.constants import B, K
+from net.common import BASE_VERSION, PROTO_VERSION, PROTO_VERSIONS
+from net.prototree import Protocol
+from net.tagconstants import Tags
+from . import treecodec
+
+#: Seconds to spend on each measurement
+DURATION = 0.5
+#: Messages sent per node search in a running network,
+#: with the pongs that acknowledge them.
+#: Counted from lookups in the simulator, handshakes left out.
+TRAFFIC = {'dht.search': 1, 'dht.response': 1, 'dht.ping': 1, 'dht.pong': 3}
+
+
+def _contact(i):
+    return Contact(Address('10.0.%d.%d' % (i >> 8, i & 255), 7000),
+                   Hash(os.urandom(B // 8)))
+
+
+def samples():
+    """
+    :returns: Sample data for every message that takes any.
+    :rtype: {str.: dict.}
+    """
+    hash_ = Hash(os.urandom(B // 8))
+    nodes = [_contact(i) for i in range(K)]
+    return {
+        'hello': {'hash': hash_, Tags.version.value: PROTO_VERSION},
+        'dh.g': {'dh_g': int.from_bytes(os.urandom(64), 'big')},
+        'dh.mix': {'dh_B': int.from_bytes(os.urandom(64), 'big')},
+        'dht.pong': {Tags.pongid.value: 1234},
+        'net.pong': {Tags.pongid.value: 1234},
+        'dht.search': {'hash': hash_},
+        'dht.response': {'hash': hash_, 'nodes': nodes},
+        'rsa.pubkey.response': {'key': os.urandom(294)},
+        'dht.store': {'hash': hash_, 'value': os.urandom(100), 'ttl': 3600},
+        'dht.find_value': {'hash': hash_},
+        'dht.value': {'hash': hash_, 'value': os.urandom(100)},
+        'dht.search.batch': {'hashes': [hash_] * 4},
+        'dht.response.batch': {'hashes': [hash_] * 4,
+                               'results': [nodes] * 4},
+        'testing': {'int': 7, 'strlist': ['a', 'bc', 'def']},
+    }
+
+
+def peer(version=BASE_VERSION):
+    """
+    :param version: Protocol version to speak with the contact.
+    :type version: int.
+    :returns: A contact with every symmetric channel keyed.
+    :rtype: :class:`~common.Contact`
+    """
+    contact = _contact(0)
+    contact.proto_version = version
+    for mode in ('aes-dht', 'aes-net'):
+        contact.create_channel(mode).crypto.set_key()
+    return contact
+
+
+def rate(func, *args):
+    """
+    :returns: Calls of func per second.
+    :rtype: float
+    """
+    calls = 0
+    start = perf_counter()
+    end = start + DURATION
+    while perf_counter() < end:
+        for _ in range(100):
+            func(*args)
+        calls += 100
+    return calls / (perf_counter() - start)
+
+
+def run(messages=None):
+    """
+    :returns: [(msg_name, size, compiled encode/s, tree encode/s,
+                compiled decode/s, tree decode/s)]
+    """
+    protocol = Protocol(lambda addr: Contact(addr))
+    contact = peer()
+    data = samples()
+    names = messages or sorted(protocol.messages)
+    rows = []
+    for name in names:
+        msg = protocol.messages[name]
+        # The RSA exchange has no channel to run over here
+        if msg.mode not in contact.channels:
+            continue
+        values = dict(data.get(name, {}))
+        values[Tags.pktid.value] = 1
+        raw = protocol.encode(name, contact, values)
+        rows.append((name, len(raw),
+                     rate(protocol.encode, name, contact, values),
+                     rate(treecodec.encode, msg, contact, values),
+                     rate(protocol.decode, raw, contact),
+                     rate(treecodec.decode, protocol.proto, raw, contact)))
+    return rows
+
+
+def versions(messages=None):
+    """
+    :returns: [(msg_name, {version: (size, encode/s, decode/s)})]
+    """
+    protocol = Protocol(lambda addr: Contact(addr))
+    contact = peer()
+    data = samples()
+    names = messages or sorted(protocol.messages)
+    rows = []
+    for name in names:
+        msg = protocol.messages[name]
+        if msg.mode not in contact.channels:
+            continue
+        values = dict(data.get(name, {}))
+        values[Tags.pktid.value] = 1
+        results = {}
+        for version in PROTO_VERSIONS:
+            contact.proto_version = version
+            raw = protocol.encode(name, contact, values)
+            results[version] = (len(raw),
+                                rate(protocol.encode, name, contact, values),
+                                rate(protocol.decode, raw, contact))
+        rows.append((name, results))
+    return rows
+
+
+def traffic(rows):
+    """
+    :param rows: Results of :func:`versions`, covering :attr:`TRAFFIC`.
+    :returns: Bytes and seconds (encode and decode)
+        spent on the traffic of one search.
+    :rtype: {version: (int, float)}
+    """
+    totals = {}
+    for name, results in rows:
+        count = TRAFFIC.get(name, 0)
+        for version, (size, encode, decode) in results.items():
+            size_sum, time_sum = totals.get(version, (0, 0))
+            totals[version] = (size_sum + count * size,
+                               time_sum + count * (1 / encode + 1 / decode))
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Protocol codec benchmark')
+    parser.add_argument('messages', nargs='*',
+                        help='Messages to run (all by default)')
+    parser.add_argument('--versions', action='store_true',
+                        help='Compare the protocol versions')
+    args = parser.parse_args()
+
+    if args.versions:
+        rows = versions(args.messages or None)
+        print('%20s' % 'message' +
+              ''.join('  %6s %10s %10s' % ('v%d B' % x, 'encode/s',
+                                           'decode/s')
+                      for x in PROTO_VERSIONS))
+        for name, results in rows:
+            print('%20s' % name +
+                  ''.join('  %6d %10.0f %10.0f' % results[x]
+                          for x in PROTO_VERSIONS))
+        print()
+        if all(x in [name for name, _ in rows] for x in TRAFFIC):
+            print('Per search (%s):' % ', '.join(
+                '%d %s' % (count, name) for name, count in TRAFFIC.items()))
+            for version, (size, seconds) in sorted(traffic(rows).items()):
+                print('  v%d  %6d bytes  %8.1f us' %
+                      (version, size, seconds * 1e6))
+            print()
+        return
+
+    print('%20s  %6s  %21s  %21s' % ('', '', 'encode / s', 'decode / s'))
+    print('%20s  %6s  %10s %10s  %10s %10s'
+          % ('message', 'bytes', 'compiled', 'tree', 'compiled', 'tree'))
+    for row in run(args.messages):
+        print('%20s  %6d  %10.0f %10.0f  %10.0f %10.0f' % row)
+    print()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Per-packet cost of the hash operations on the DHT path.
+
+Every bucket-eligible packet runs one XOR + significant bit
+(:meth:`~kademlia.bucket.Buckets.update`), every HashTag decode
+builds a :class:`~common.Hash`, and every lookup sorts by distance.
+The legacy functions reproduce the old bytes round-tripping
+implementation so the two can be compared side by side.
+"""
+import os
+
+from common import Hash, Property
+from kademlia.constants import B, K
+from .util import per_call, report
+
+
+def _legacy_xor(a, b):
+    i = int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')
+    return i.to_bytes(len(a), 'little')
+
+
+def _legacy_hash(value):
+    # The old Hash was a Property, which allocates an Event per instance
+    return Property('hash', value)
+
+
+def _legacy_significant_bit(value):
+    for i in range(0, len(value)):
+        b = 128
+        for j in range(0, 8):
+            if value[i] & b:
+                return ((len(value) * 8) - (i * 8) - j)
+            b //= 2
+    return 0
+
+
+def main():
+    size = B // 8
+    own_raw = os.urandom(size)
+    # Keep the top byte close so the bit scan is realistic (deep bucket)
+    peer_raw = own_raw[:1] + os.urandom(size - 1)
+    own, peer = Hash(own_raw), Hash(peer_raw)
+    peers_raw = [os.urandom(size) for _ in range(K)]
+    peers = [Hash(x) for x in peers_raw]
+
+    rows = [
+        ('legacy: xor + significant_bit',
+         per_call(lambda: _legacy_significant_bit(
+             _legacy_hash(_legacy_xor(peer_raw, own_raw)).value),
+                  number=10000)),
+        ('hash:   xor + significant_bit',
+         per_call(lambda: (peer ^ own).significant_bit())),
+        ('legacy: construct from bytes',
+         per_call(lambda: _legacy_hash(peer_raw), number=10000)),
+        ('hash:   construct from bytes',
+         per_call(lambda: Hash(peer_raw))),
+        ('legacy: sort K by distance',
+         per_call(lambda: sorted(peers_raw, key=lambda x: _legacy_hash(
+                     _legacy_xor(x, own_raw)).value),
+                  number=1000)),
+        ('hash:   sort K by distance',
+         per_call(lambda: sorted(peers, key=lambda x: x ^ own),
+                  number=10000)),
+    ]
+    report('Hash operations (B=%d, K=%d)' % (B, K), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""
+Lookup performance across network sizes and K / A / B settings.
+
+Every configuration boots a simulated network (:mod:`sim`),
+then runs lookups for random live nodes from random other nodes
+and reports hops and RPCs per lookup, p50 / p99 lookup latency
+(virtual seconds), routing table size and the success rate.
+
+Results are written as JSON so runs from different releases can be
+compared: pass an earlier result file as ``--baseline`` and any metric
+that got worse by more than ``--tolerance`` fails the run.
+
+::
+
+    python3 -m bench.lookups --out lookups.json
+    python3 -m bench.lookups --baseline lookups.json
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+from itertools import product
+
+from kademlia.constants import A, B, K
+from sim import Network
+
+#: Network sizes to run
+SIZES = [50, 200]
+#: (K, A, B) settings to run, the shipped constants first
+SETTINGS = [(K, A, B), (8, 3, B), (K, 1, B), (K, 3, 160)]
+#: Lookups per configuration
+LOOKUPS = 100
+#: Virtual seconds a lookup may take before it counts as failed
+LOOKUP_TIMEOUT = 60
+#: Metrics where a larger value is a regression
+LOWER_IS_BETTER = ['hops_mean', 'rpcs_mean', 'latency_p50',
+                   'latency_p99', 'table_bytes_mean']
+#: Metrics where a smaller value is a regression
+HIGHER_IS_BETTER = ['success_rate']
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile.
+
+    :param values: The samples.
+    :type values: [float]
+    :param pct: The percentile, 0 - 100.
+    :type pct: float
+    :rtype: float
+    """
+    if len(values) == 0:
+        return None
+    ordered = sorted(values)
+    rank = max(0, -(-len(ordered) * pct // 100) - 1)
+    return ordered[int(rank)]
+
+
+def table_size(buckets):
+    """
+    Approximate memory held by a routing table itself:
+    the bucket objects and their contact / waitlist lists.
+    The contacts are shared with the contact table, so they are not counted.
+
+    :param buckets: The routing table.
+    :type buckets: :class:`~kademlia.bucket.Buckets`
+    :returns: (entries, bytes)
+    :rtype: (int., int.)
+    """
+    entries = 0
+    size = sys.getsizeof(buckets._buckets)
+    for bucket in buckets._buckets:
+        entries += len(bucket.contacts) + len(bucket.waitlist)
+        size += (sys.getsizeof(bucket) + sys.getsizeof(bucket.__dict__) +
+                 sys.getsizeof(bucket.contacts) +
+                 sys.getsizeof(bucket.waitlist))
+    return entries, size
+
+
+def run_config(size, k, a, b, lookups=LOOKUPS, seed=1, tail=(0.0, 0.0),
+               geographic=False, proximity=False):
+    """
+    Boots one network and measures lookups on it.
+    The last three are passed on to the :class:`~sim.network.Network`.
+
+    :returns: The configuration and its metrics.
+    :rtype: dict.
+    """
+    # Refresh jitter draws from the module rng, seed it for repeatable runs
+    random.seed(seed)
+    network = Network(K=k, B=b, A=a, seed=seed, tail=tail,
+                      geographic=geographic, proximity=proximity)
+    network.grow(size)
+    hops, rpcs, latencies = [], [], []
+    found = 0
+    done = set()
+    for _ in range(lookups):
+        # Fresh pairs only, a cache hit would measure nothing
+        source, target = network.rng.sample(network.nodes, 2)
+        while (source, target) in done:
+            source, target = network.rng.sample(network.nodes, 2)
+        done.add((source, target))
+        start = network.clock.time
+        future = source.kademlia.init_search(target.contact.hash)
+        if not network.wait(future, LOOKUP_TIMEOUT):
+            continue
+        result = future.result()
+        if result.found is None:
+            continue
+        found += 1
+        hops.append(result.hops)
+        rpcs.append(result.rpcs)
+        latencies.append(network.clock.time - start)
+    tables = [table_size(node.kademlia.buckets) for node in network.nodes]
+    return {
+        'nodes': size, 'K': k, 'A': a, 'B': b, 'lookups': lookups,
+        'success_rate': found / lookups,
+        'hops_mean': _mean(hops),
+        'hops_max': max(hops) if hops else None,
+        'rpcs_mean': _mean(rpcs),
+        'latency_p50': percentile(latencies, 50),
+        'latency_p99': percentile(latencies, 99),
+        'table_entries_mean': _mean([x[0] for x in tables]),
+        'table_bytes_mean': _mean([x[1] for x in tables]),
+        'datagrams': network.fabric.sent,
+    }
+
+
+def _mean(values):
+    if len(values) == 0:
+        return None
+    return sum(values) / len(values)
+
+
+def _key(row):
+    return (row['nodes'], row['K'], row['A'], row['B'])
+
+
+def compare(results, baseline, tolerance):
+    """
+    :returns: Descriptions of every metric that regressed past tolerance.
+    :rtype: [str.]
+    """
+    old = {_key(row): row for row in baseline['results']}
+    regressions = []
+    for row in results:
+        before = old.get(_key(row))
+        if before is None:
+            continue
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            new_v, old_v = row.get(metric), before.get(metric)
+            if new_v is None or old_v is None or old_v == 0:
+                continue
+            change = (new_v - old_v) / old_v
+            if metric in HIGHER_IS_BETTER:
+                change = -change
+            if change > tolerance:
+                regressions.append('%s %s: %.4g -> %.4g'
+                                   % (_key(row), metric, old_v, new_v))
+    return regressions
+
+
+def report(results):
+    cols = ['nodes', 'K', 'A', 'B', 'success_rate', 'hops_mean',
+            'rpcs_mean', 'latency_p50', 'latency_p99', 'table_bytes_mean']
+    print('  '.join('%12s' % c for c in cols))
+    for row in results:
+        print('  '.join('%12s' % ('-' if row[c] is None else
+                                  '%.3g' % row[c]) for c in cols))
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Kademlia lookup benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--lookups', type=int, default=LOOKUPS)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tail', type=float, nargs=2, default=[0.0, 0.0],
+                        metavar=('CHANCE', 'SEC'),
+                        help='Hold up this share of datagrams by SEC')
+    parser.add_argument('--geographic', action='store_true',
+                        help='Latency from random node positions')
+    parser.add_argument('--proximity', action='store_true',
+                        help='Run the nodes in proximity mode')
+    parser.add_argument('--out', help='Write the results as JSON')
+    parser.add_argument('--baseline', help='Earlier results to compare to')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    tail = tuple(args.tail)
+    results = [run_config(size, k, a, b, args.lookups, args.seed, tail,
+                          args.geographic, args.proximity)
+               for size, (k, a, b) in product(args.sizes, SETTINGS)]
+    report(results)
+    doc = {'python': platform.python_version(), 'seed': args.seed,
+           'tail': tail, 'geographic': args.geographic,
+           'proximity': args.proximity, 'results': results}
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(doc, f, indent=4)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print('REGRESSION', line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+Frozen copy of the interpreted codec that walked the protocol tree,
+from before messages were compiled (:mod:`net.codec`).
+
+Only kept as the baseline that ``bench.codec`` compares the compiled
+codecs against, so it is never used by the stack.
+It speaks protocol version 1 alone, and is not kept up with changes
+to the wire format: :mod:`net.codec` is the one implementation.
+"""
+import struct
+
+from common.exceptions import ProtocolError, ChannelDNEError
+from net.common import (MAGIC_HEADER, BASE_VERSION,
+                        VERSION_SYMBOL, TYPE_SYMBOL, SIZE_SYMBOL)
+from net.prototree import CarrierMessage, Encrypted
+from net.tagconstants import Tags
+
+
+def _encode_tags(message, dict_data):
+    data = b''
+    for tag in message.tags:
+        data += tag.for_version(BASE_VERSION)\
+            .to_encoded(dict_data[tag.name])
+    return data
+
+
+def encode(message, contact, dict_data, bytes_data=b''):
+    """
+    Encodes a message by walking up to the carrier.
+
+    :param message: The leaf message (or the level reached so far).
+    :type message: :class:`~net.prototree.Message`
+    :param contact: Contact that this message is going to.
+    :type contact: :class:`common.Contact`
+    :param dict_data: Data to encode.
+    :type dict_data: {}
+    :param bytes_data: Raw encoded data so far.
+    :type bytes_data: bytes
+    :rtype: bytes
+    """
+    if isinstance(message, CarrierMessage):
+        return (MAGIC_HEADER + struct.pack(VERSION_SYMBOL, BASE_VERSION) +
+                bytes_data)
+    data = struct.pack(TYPE_SYMBOL, message.index)
+    if isinstance(message, Encrypted):
+        data += contact.channels[message.mode].crypto.encrypt(
+            _encode_tags(message, dict_data) + bytes_data)
+    else:
+        data += _encode_tags(message, dict_data) + bytes_data
+    return encode(message.parent, contact, dict_data, data)
+
+
+def decode(message, data, contact):
+    """
+    Decodes a packet by walking down from the carrier.
+
+    :param message: The carrier (or the level reached so far).
+    :type message: :class:`~net.prototree.Message`
+    :param data: Data to decode.
+    :type data: bytes
+    :param contact: Contact that this message came from.
+    :type contact: :class:`common.Contact`
+    :returns: msg_name, data
+    """
+    offset = 0
+    if isinstance(message, CarrierMessage):
+        if data[:len(MAGIC_HEADER)] != MAGIC_HEADER:
+            raise ProtocolError("Magic string does not match")
+        offset += len(MAGIC_HEADER)
+        version = struct.unpack(VERSION_SYMBOL,
+                                data[offset:offset +
+                                     struct.calcsize(VERSION_SYMBOL)])[0]
+        if version != BASE_VERSION:
+            raise ProtocolError("Protocol is from a different version")
+        offset += struct.calcsize(VERSION_SYMBOL)
+        pkt_type = struct.unpack(TYPE_SYMBOL,
+                                 data[offset:offset +
+                                      struct.calcsize(TYPE_SYMBOL)])[0]
+        offset += struct.calcsize(TYPE_SYMBOL)
+        msg_name, r_dict = decode(message.submessages[pkt_type],
+                                  data[offset:], contact)
+        r_dict[Tags.type.value] = pkt_type
+        return msg_name, r_dict
+    if isinstance(message, Encrypted):
+        try:
+            data = contact.channels[message.mode].crypto.decrypt(data)
+        except KeyError:
+            raise ChannelDNEError(message.mode)
+    msg_name = message.msg_name
+    ret_data = {}
+    size_value_size = struct.calcsize(SIZE_SYMBOL)
+    for tag in message.tags:
+        size = struct.unpack(SIZE_SYMBOL,
+                             data[offset:offset + size_value_size])[0]
+        offset += size_value_size
+        ret_data[tag.name] = tag.for_version(BASE_VERSION)\
+            .to_value(data[offset:offset + size])
+        offset += size
+    if len(message.submessages) > 0:
+        pkt_type = struct.unpack(TYPE_SYMBOL,
+                                 data[offset:offset +
+                                      struct.calcsize(TYPE_SYMBOL)])[0]
+        offset += struct.calcsize(TYPE_SYMBOL)
+        ret_data[Tags.type.value] = pkt_type
+        msg_name, ret_data[Tags.payload.value] = decode(
+            message.submessages[pkt_type], data[offset:], contact)
+    return msg_name, ret_data
@@ -0,0 +1,34 @@
+from timeit import Timer
+
+
+def per_call(func, number=100000, repeat=5):
+    """
+    Times a function, taking the best of several runs.
+
+    :param func: Zero argument callable to time.
+    :param number: Calls per run.
+    :type number: int.
+    :param repeat: Amount of runs.
+    :type repeat: int.
+    :returns: Nanoseconds per call.
+    :rtype: float
+    """
+    best = min(Timer(func).repeat(repeat=repeat, number=number))
+    return best / number * 1e9
+
+
+def report(title, rows):
+    """
+    Prints a simple table of timings.
+
+    :param title: Heading for the table.
+    :type title: str.
+    :param rows: (name, ns per call) pairs.
+    :type rows: [(str., float)]
+    """
+    print(title)
+    print('-' * len(title))
+    width = max(len(name) for name, _ in rows)
+    for name, ns in rows:
+        print('%s  %10.1f ns' % (name.ljust(width), ns))
+    print()
@@ -0,0 +1,79 @@
+"""
+Startup cost of seeding the routing table from the datastore.
+
+The legacy path loads every swarm row, builds a full contact
+(including its crypto channel) for each and pushes them all
+through the contact table and the buckets.
+The warm-start path only loads the most recently seen
+K contacts per bucket and leaves the channels to first use.
+"""
+import os
+import sys
+from random import random
+from tempfile import TemporaryDirectory
+from time import perf_counter, time
+
+from common import Hash
+from common.sqlite import dbinterface
+from kademlia.bucket import Buckets
+from kademlia.constants import B, K
+from net.contacttable import ContactTable
+
+#: Swarm sizes to time
+SIZES = [1000, 10000, 50000]
+#: A stand-in DH group, it is only stored on the channel
+DH_P = 23
+
+
+def _fill(db, size):
+    rows = []
+    now = time()
+    for i in range(size):
+        rows.append(('10.%d.%d.%d' % (i >> 16, (i >> 8) & 255, i & 255),
+                     7000, os.urandom(B // 8),
+                     now - random() * 86400, 50 + random() * 1000))
+    with db.conn:
+        db.conn.executemany('INSERT INTO swarm(ip, port, hash, '
+                            'last_seen, ping) VALUES(?,?,?,?,?)', rows)
+
+
+def _legacy(db, own):
+    contacts = db.contacts()
+    for contact in contacts:
+        contact.channels
+    contacts = ContactTable(DH_P).update(contacts)
+    Buckets(own, K, B).seed(contacts)
+    return len(contacts)
+
+
+def _warm(db, own):
+    contacts = ContactTable(DH_P).update(db.recent_contacts(own, K))
+    Buckets(own, K, B).seed(contacts)
+    return len(contacts)
+
+
+def _time(func, *args):
+    start = perf_counter()
+    n = func(*args)
+    return (perf_counter() - start) * 1000, n
+
+
+def main():
+    own = Hash(os.urandom(B // 8))
+    print('Routing table warm start')
+    print('------------------------')
+    print('%8s  %16s  %16s' % ('rows', 'legacy', 'warm start'))
+    for size in SIZES:
+        with TemporaryDirectory() as dir_:
+            db = dbinterface(dir_)
+            _fill(db, size)
+            legacy, n_legacy = _time(_legacy, db, own)
+            warm, n_warm = _time(_warm, db, own)
+            db.close()
+        print('%8d  %7.1f ms %6d  %7.1f ms %6d'
+              % (size, legacy, n_legacy, warm, n_warm))
+    print()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,9 +15,9 @@ def print_status():
 
 def print_buckets():
     s = state.get()
-    for idx, bucket in enumerate(s.kademlia.buckets._buckets):
-        if (len(bucket.contacts) > 0):
-            print(idx, bucket.contacts)
+    for idx, bucket in enumerate(s.kademlia.buckets.snapshot.buckets):
+        if (len(bucket) > 0):
+            print(idx, list(bucket))
 
 
 def print_shortlists():
@@ -44,9 +44,7 @@ def add_contact():
         ip = '127.0.0.1'
     port = int(input("Port: "))
     contact = s.net._contacts.translate(Address(ip, port))
-    s.net.send_data(contact,
-                    'hello',
-                    {'hash': s.contact.hash})
+    s.net.send_hello(contact)
 
     # Make it so we seed once we join the DHT
     def start_search(contact):
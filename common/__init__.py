@@ -2,7 +2,10 @@ from .address import Address as Address
 from .contact import Contact as Contact
 from .contact import Friend as Friend
 from .event import Event as Event
+from .clock import Clock as Clock
+from .clock import VirtualClock as VirtualClock
 from .hash import Hash as Hash
+from .hash import Distance as Distance
 from .list import List as List
 from .sentpacket import SentPacket as SentPacket
 from .sqlite import dbinterface as dbinterface
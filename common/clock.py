@@ -0,0 +1,199 @@
+from datetime import datetime, timedelta
+from heapq import heappush, heappop
+from itertools import count
+from threading import Thread
+from time import monotonic
+from queue import Queue, Empty
+
+from .btlxlogger import get as get_logger
+
+
+class TaskLoop():
+    """
+    A single worker thread running posted and timed calls in order.
+    Everything posted to one loop runs on the same thread,
+    so the code it runs needs no locks of its own.
+    """
+
+    def __init__(self):
+        self._tasks = Queue()
+        # [(monotonic deadline, seq, func, args)]
+        self._timers = []
+        self._seq = count()
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def post(self, func, *args):
+        """
+        Runs a call on the loop as soon as possible.
+        """
+        self._tasks.put((func, args))
+
+    def call_at(self, when, func, *args):
+        """
+        Runs a call on the loop once :func:`time.monotonic` passes `when`.
+        """
+        self._tasks.put((self._add_timer, (when, func, args)))
+
+    def call_later(self, delay, func, *args):
+        """
+        Runs a call on the loop after `delay` seconds.
+        """
+        self.call_at(monotonic() + delay, func, *args)
+
+    def _add_timer(self, when, func, args):
+        heappush(self._timers, (when, next(self._seq), func, args))
+
+    def _next_timeout(self):
+        if len(self._timers) == 0:
+            return None
+        return max(0, self._timers[0][0] - monotonic())
+
+    def _call(self, func, args):
+        try:
+            func(*args)
+        except Exception:
+            get_logger(__name__).exception("Task %s failed" % func)
+
+    def _run(self):
+        """
+        .. note:: This call is blocking, so run it threaded.
+        """
+        while (True):
+            try:
+                func, args = self._tasks.get(timeout=self._next_timeout())
+            except Empty:
+                pass
+            else:
+                self._call(func, args)
+            now = monotonic()
+            while len(self._timers) > 0 and self._timers[0][0] <= now:
+                _, _, func, args = heappop(self._timers)
+                self._call(func, args)
+
+
+class Clock():
+    """
+    The wall clock.
+    Components ask their clock for the time and for a
+    :class:`~common.clock.TaskLoop` to run their background work on,
+    so the same code can be driven by a
+    :class:`~common.clock.VirtualClock` instead.
+    """
+
+    def now(self):
+        """
+        :rtype: :class:`datetime.datetime`
+        """
+        return datetime.now()
+
+    def monotonic(self):
+        """
+        :returns: Seconds on a clock that never goes backwards.
+        :rtype: float
+        """
+        return monotonic()
+
+    def loop(self):
+        """
+        :returns: A new loop, with a thread of its own.
+        :rtype: :class:`~common.clock.TaskLoop`
+        """
+        return TaskLoop()
+
+
+#: The clock used when a component is not given one
+REAL = Clock()
+
+
+class VirtualClock():
+    """
+    A discrete event clock for simulations.
+    Time only moves when :func:`run` is called, jumping straight
+    to the next scheduled call, so no threads or sleeps are needed.
+    Every loop handed out is the clock itself, which makes all
+    work of every component on it run on the calling thread.
+
+    .. attribute:: time
+
+        Seconds since the clock started.
+    """
+
+    #: The wall time that virtual time 0 maps to
+    EPOCH = datetime(2000, 1, 1)
+
+    def __init__(self):
+        self.time = 0.0
+        self._timers = []
+        self._seq = count()
+
+    def now(self):
+        return self.EPOCH + timedelta(seconds=self.time)
+
+    def monotonic(self):
+        return self.time
+
+    def loop(self):
+        return self
+
+    def post(self, func, *args):
+        self.call_at(self.time, func, *args)
+
+    def call_at(self, when, func, *args):
+        heappush(self._timers, (max(when, self.time), next(self._seq),
+                                func, args))
+
+    def call_later(self, delay, func, *args):
+        self.call_at(self.time + delay, func, *args)
+
+    @property
+    def pending(self):
+        """
+        :returns: Amount of scheduled calls.
+        :rtype: int.
+        """
+        return len(self._timers)
+
+    def step(self):
+        """
+        Runs the next scheduled call, moving time up to it.
+
+        :returns: If there was anything to run.
+        :rtype: bool.
+        """
+        if len(self._timers) == 0:
+            return False
+        when, _, func, args = heappop(self._timers)
+        self.time = when
+        func(*args)
+        return True
+
+    def run(self, until=None, predicate=None):
+        """
+        Runs scheduled calls in time order.
+
+        .. warning::
+
+            Without `until` it only stops once nothing is scheduled,
+            or once `predicate` holds.
+            A running :class:`~kademlia.Kademlia` always has calls
+            scheduled (bucket refreshes and republishing schedule
+            their next sweep each time), so in a simulation that
+            never happens and this does not return:
+            give `until`, or a `predicate` that becomes True.
+
+        :param until: Virtual time to stop at
+            (if None, runs until nothing is scheduled).
+        :type until: float
+        :param predicate: Stop as soon as this returns True.
+        :type predicate: () => bool.
+        """
+        while len(self._timers) > 0:
+            if predicate is not None and predicate():
+                return
+            if until is not None and self._timers[0][0] > until:
+                break
+            self.step()
+        if until is not None:
+            self.time = max(self.time, until)
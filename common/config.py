@@ -20,6 +20,7 @@ DEFAULT_CONF = {
         'group': 7,
         'bucket_size': 20,
         'paralellism': 3,
+        'proximity': False,
         'keysize': 320,
         'keyfile': 'data/key.pem'
     }
@@ -94,6 +95,7 @@ def get():
     if CONFIG is None:
         p = argparse.ArgumentParser(description="ByteLynx Server")
         p.add_argument('--dir', help="This instance's config root")
-        args = p.parse_args()
+        # Leave any other args to the tool that was started
+        args, _ = p.parse_known_args()
         CONFIG = get_testing_config(args.dir)
     return CONFIG
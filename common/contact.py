@@ -47,6 +47,9 @@ class Contact(Property):
     .. attribute:: on_death
 
         Event thrown when the contact has died.
+    .. attribute:: net
+
+        The :class:`~net.Stack` that this contact is reached through.
     """
 
     #: Sliding counter on ping response times
@@ -57,6 +60,11 @@ class Contact(Property):
     counter = 0
     #: If a hash has been scraped from the contact yet
     needs_hash = True
+    #: Stack that this contact talks through, set by its contact table
+    net = None
+    #: Protocol version spoken with the contact, agreed on in hello.
+    #: Everyone speaks version 1 until then.
+    proto_version = 1
 
     _flatten_attrs = ['ping',
                       'liveliness',
@@ -68,7 +76,8 @@ class Contact(Property):
         self.address = addr
         self.last_seen = datetime.now()
         self.pings = list()
-        self.channels = {}
+        self._channels = None
+        self._dh_p = None
         self.has_friend = False
         self.on_death = Event('Contact.on_death')
         self.on_hash = Event('Contact.on_hash')
@@ -79,7 +88,30 @@ class Contact(Property):
         self.sent_msg_queue = defaultdict(list)
         self.recv_msg_queue = defaultdict(list)
 
-        self.create_channel('bytelynx')
+    @property
+    def channels(self):
+        """
+        All currently established channels for this contact.
+        The base 'bytelynx' channel (and its crypto) is only
+        made on first use, so idle contacts stay cheap.
+        """
+        if self._channels is None:
+            self._channels = {}
+            self.create_channel('bytelynx')
+            if self._dh_p is not None:
+                self._channels['bytelynx'].crypto.p = self._dh_p
+        return self._channels
+
+    def set_dh_group(self, p):
+        """
+        Sets the Diffie-Hellman group of the base channel.
+        Deferred until the channel is made if it does not exist yet.
+
+        :param p: The 'p' parameter for the group.
+        """
+        self._dh_p = p
+        if self._channels is not None:
+            self._channels['bytelynx'].crypto.p = p
 
     def __str__(self):
         try:
@@ -91,6 +123,15 @@ class Contact(Property):
     def __repr__(self):
         return '%s' % (self.address)
 
+    @property
+    def cost(self):
+        """
+        :return: Expected cost (ms) of a request to this contact:
+            its ping, inflated by how often it misses packets.
+        :rtype: float
+        """
+        return self.ping / max(self.liveliness, DEATH_THRESHOLD)
+
     @property
     def is_alive(self):
         """
@@ -142,15 +183,11 @@ class Contact(Property):
     def on_channel_finalization(self, channel):
         # If we had messages waiting on the creation of this channel
         if len(self.sent_msg_queue[channel.mode]) > 0:
-            import state
-            net = state.get().net
             for msg_name, data in self.sent_msg_queue[channel.mode]:
-                net.send_data(self, msg_name, data)
+                self.net.send_data(self, msg_name, data)
         if len(self.recv_msg_queue[channel.mode]) > 0:
-            import state
-            net = state.get().net
             for addr, raw_data in self.recv_msg_queue[channel.mode]:
-                net.on_data(addr, raw_data)
+                self.net.on_data(addr, raw_data)
         self.channel_finalization(channel.mode)
 
 
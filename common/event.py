@@ -4,6 +4,10 @@ import traceback
 import sys
 
 
+#: Classes made so far, by event name
+_classes = {}
+
+
 def Event(name):
     """
     A mutator for events.
@@ -12,9 +16,14 @@ def Event(name):
     dynamically make classes for each unique event.
     This way, debugging is easier,
     since we can tell which event is which.
+
+    The class for a name is only made once and then reused,
+    so creating events on hot paths stays cheap.
     """
-    c = new_class(name, bases=(_Event,))(name)
-    return c
+    cls = _classes.get(name)
+    if cls is None:
+        cls = _classes.setdefault(name, new_class(name, bases=(_Event,)))
+    return cls(name)
 
 
 class _Event():
@@ -1,5 +1,4 @@
 import base64
-from .property import Property
 
 
 def hash_from_pub(pubkey, bitsize):
@@ -18,13 +17,36 @@ def hash_from_pub(pubkey, bitsize):
     return Hash(sha_hash(pubkey, bitsize))
 
 
-class Hash(Property):
+class Distance(int):
     """
-    Container for a hash.
+    The XOR distance between two :class:`~common.Hash` objects.
+
+    This is a plain int underneath, so comparisons, sorting
+    and heap operations all run at native int speed.
+    """
+
+    __slots__ = ()
+
+    def significant_bit(self):
+        """
+        :returns: The most significant bit place (0 for a perfect match).
+        :rtype: int.
+        """
+        return self.bit_length()
+
+
+class Hash():
+    """
+    Immutable container for a hash.
+    The big-endian integer value is computed once on creation,
+    so distance math never goes back through bytes.
+    There are no setters; treat an instance as a value.
+
     Overloads:
     ::
         len()
         str()
+        int()
         hash()
         <, >
         ==, !=
@@ -35,17 +57,46 @@ class Hash(Property):
         The :class:`bytes` object that is the raw hash.
     """
 
+    __slots__ = ('_value', '_int')
+
     def __init__(self, value):
-        super().__init__('hash', value)
+        value = bytes(value)
+        self._value = value
+        self._int = int.from_bytes(value, 'big')
+
+    @classmethod
+    def from_int(cls, value, size):
+        """
+        Constructs a hash from an integer.
 
-    def __len__(self, other):
+        :param value: The integer value of the hash.
+        :type value: int.
+        :param size: Size of the hash, in bytes.
+        :type size: int.
+        :rtype: :class:`~common.Hash`
+        """
+        return cls(value.to_bytes(size, 'big'))
+
+    @property
+    def value(self):
+        """
+        The raw bytes of this hash.
+        """
+        return self._value
+
+    def __len__(self):
         return len(self._value)
 
+    def __int__(self):
+        return self._int
+
     def __str__(self):
         return '%s:%s' % ('h', self._value)
 
+    def __repr__(self):
+        return '<Hash %s>' % self.base64
+
     def __hash__(self):
-        # TODO: Should this just return self._value?
         return hash(self._value)
 
     def __lt__(self, other):
@@ -61,7 +112,7 @@ class Hash(Property):
             return False
 
     def __ne__(self, other):
-        return self._value != other.value
+        return not self.__eq__(other)
 
     def flatten(self):
         """
@@ -76,36 +127,32 @@ class Hash(Property):
         :returns: the absolute difference between two hashes
         :rtype: :class:`~common.Hash`
         """
-        if (other > self):
-            return other - self
-        return self - other
+        if (len(self._value) != len(other.value)):
+            raise ValueError("Hashes are not of the same length.")
+        return Hash.from_int(abs(self._int - other._int), len(self._value))
 
     def __sub__(self, other):
         if (len(self._value) != len(other.value)):
             raise ValueError("Hashes are not of the same length.")
-        i = (int.from_bytes(self._value, 'little') -
-             int.from_bytes(other.value, 'little'))
-        return Hash(i.to_bytes(len(self._value), 'little'))
+        size = len(self._value)
+        i = (self._int - other._int) % (1 << (size * 8))
+        return Hash.from_int(i, size)
 
     def __xor__(self, other):
-        if (len(self._value) != len(other.value)):
+        """
+        :returns: The XOR distance to another hash.
+        :rtype: :class:`~common.hash.Distance`
+        """
+        if (len(self._value) != len(other._value)):
             raise ValueError("Hashes are not of the same length.")
-        i = (int.from_bytes(self._value, 'little') ^
-             int.from_bytes(other.value, 'little'))
-        return Hash(i.to_bytes(len(self._value), 'little'))
+        return Distance(self._int ^ other._int)
 
     def significant_bit(self):
         """
         :returns: The most significant bit place.
         :rtype: int.
         """
-        for i in range(0, len(self._value)):
-            b = 128
-            for j in range(0, 8):
-                if self._value[i] & b:
-                    return ((len(self._value) * 8) - (i * 8) - j)
-                b //= 2
-        return 0
+        return self._int.bit_length()
 
     @property
     def bit_string(self):
@@ -113,16 +160,7 @@ class Hash(Property):
         :returns: String of 0's and 1's.
         :rtype: str.
         """
-        str_data = ''
-        for i in range(0, len(self._value)):
-            b = 128
-            for j in range(0, 8):
-                if (self._value[i] & b != 0):
-                    str_data += '1'
-                else:
-                    str_data += '0'
-                b //= 2
-        return str_data
+        return format(self._int, '0%db' % (len(self._value) * 8))
 
     @property
     def base64(self):
@@ -1,7 +1,7 @@
 
-from threading import Lock, Thread
-from time import sleep
+from threading import Lock
 
+from .clock import REAL
 from .list import List as list
 from .event import Event
 from .btlxlogger import get as get_logger
@@ -24,47 +24,49 @@ class PacketWatcher():
     #: Time to sleep in between resend sweeps
     _sleep_time = 0.2
 
-    def __init__(self):
+    def __init__(self, clock=REAL):
+        """
+        :param clock: Source of the loop the sweeps run on.
+        :type clock: :class:`~common.Clock`
+        """
         self._packets = list()
         self._action_list = list()
         self._rm_dict = list()
         self.on_resend = Event('PacketWatcher.on_resend')
 
         self._lock = Lock()
-        self._thread = Thread(target=self._sweep)
-        self._thread.daemon = True
-        self._thread.start()
+        self._loop = clock.loop()
+        self._loop.post(self._sweep)
 
     def _sweep(self):
         """
-        Target for a separate thread.
+        Runs on the watcher's loop, rescheduling itself.
         Only 1 thread may run this function.
 
         Sweeps through all of the recently sent packets.
         Checks for any that are stale (need resending)
         or any that have been awk'ed.
         """
-        while True:
-            with self._lock:
-                for action, param in self._action_list:
-                    action(param)
-                self._action_list = list()
-            # Remove awked packets
-            removed, self._packets = self._packets.split(
-                lambda x: x.info in self._rm_dict)
-            self._rm_dict = {}
-            for pkt in removed:
-                pkt.contact.change_ping(pkt.rtt)
-            # Remove dead packets
-            dead, self._packets = self._packets.split(
-                lambda x: x.ctt > x.contact.ping * TIMEOUTMULT)
-            for pkt in dead:
-                Logger.info("DEAD PACKET: %s > %s" % (pkt.ctt, pkt.contact.ping))
-                pkt.contact.change_liveliness()
-                if pkt.contact.is_alive:
-                    self.on_resend(pkt)
-            # Sleep a little bit before sweeping again
-            sleep(self._sleep_time)
+        # Wait a little bit before sweeping again
+        self._loop.call_later(self._sleep_time, self._sweep)
+        with self._lock:
+            for action, param in self._action_list:
+                action(param)
+            self._action_list = list()
+        # Remove awked packets
+        removed, self._packets = self._packets.split(
+            lambda x: x.info in self._rm_dict)
+        self._rm_dict = {}
+        for pkt in removed:
+            pkt.contact.change_ping(pkt.rtt)
+        # Remove dead packets
+        dead, self._packets = self._packets.split(
+            lambda x: x.ctt > x.contact.ping * TIMEOUTMULT)
+        for pkt in dead:
+            Logger.info("DEAD PACKET: %s > %s" % (pkt.ctt, pkt.contact.ping))
+            pkt.contact.change_liveliness()
+            if pkt.contact.is_alive:
+                self.on_resend(pkt)
 
     def rm_packet(self, pkt_id, channel):
         with self._lock:
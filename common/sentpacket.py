@@ -1,4 +1,4 @@
-from datetime import datetime
+from .clock import REAL
 
 
 class SentPacket():
@@ -25,12 +25,13 @@ class SentPacket():
         If an answer to the packet has been seen.
     """
 
-    def __init__(self, pktid, data, contact, channel):
+    def __init__(self, pktid, data, contact, channel, clock=REAL):
         self.pkt_id = pktid
         self.data = data
         self.contact = contact
         self.channel = channel
-        self.sent_time = datetime.now()
+        self._clock = clock
+        self.sent_time = clock.now()
         self.awked = False
 
     def refresh(self):
@@ -38,10 +39,10 @@ class SentPacket():
         'Refreshes' the sent time and any other attrs
         for when a packet is resent.
         """
-        self.sent_time = datetime.now()
+        self.sent_time = self._clock.now()
 
     def ack(self):
-        self.received_time = datetime.now()
+        self.received_time = self._clock.now()
 
     @property
     def ctt(self):
@@ -49,7 +50,7 @@ class SentPacket():
         :return: How long this ping has been active
         :rtype: float
         """
-        td = datetime.now() - self.sent_time
+        td = self._clock.now() - self.sent_time
         return td.total_seconds() * 1000
 
     @property
@@ -1,76 +1,270 @@
 #!/usr/bin/python3
+import atexit
 import sqlite3
+from datetime import datetime
 from os import path
+from threading import Lock
+from weakref import WeakSet
 
+from .clock import REAL
 from .contact import Contact, Friend
 from .address import Address
 from .hash import Hash
+from .btlxlogger import get as get_logger
 
 #: Table creation schema
 INITSTATEMENT = '''CREATE TABLE IF NOT EXISTS swarm
                     (key INTEGER PRIMARY KEY, ip VARCHAR(15),
-                     port INTEGER, hash BLOB);
+                     port INTEGER, hash BLOB,
+                     last_seen REAL DEFAULT 0, ping REAL DEFAULT 1500);
                    CREATE TABLE IF NOT EXISTS friends
                     (key INTEGER PRIMARY KEY, nickname TEXT,
                      publickey blob);
+                   DELETE FROM swarm WHERE key NOT IN
+                    (SELECT MAX(key) FROM swarm GROUP BY ip, port);
+                   CREATE UNIQUE INDEX IF NOT EXISTS swarm_addr
+                    ON swarm(ip, port);
                 '''
 
+#: Columns added to the swarm table after its first release
+SWARM_MIGRATIONS = [('last_seen', 'REAL DEFAULT 0'),
+                    ('ping', 'REAL DEFAULT 1500')]
+
+#: Seconds between write-behind flushes
+FLUSH_SEC = 2
+#: Pending changes that trigger an early flush
+FLUSH_MAX = 500
+
+#: Databases that are still open, flushed at exit.
+#: Weak, so a database that is dropped is not kept alive for it.
+_open = WeakSet()
+
+
+@atexit.register
+def _flush_all():
+    """
+    Writes the queued changes of every open database at exit.
+    """
+    for db in list(_open):
+        db.flush()
+
 
 # TODO: Clean up this interface. Can sqlite do this better for me?
 
 class dbinterface():
     """
     Abstraction layer for the sqlite db.
+
+    Swarm changes (:func:`add_contact` / :func:`rm_contact`) are
+    write-behind: they are queued, coalesced per address and written
+    in one transaction on a loop from the clock every
+    :attr:`~common.sqlite.FLUSH_SEC` seconds.
+    Call :func:`flush` to force them out (this is done at exit
+    for every database that has not been closed).
+
+    Each swarm row also keeps when the contact was last seen and
+    its ping, so :func:`recent_contacts` can warm-start the routing
+    table from the most useful contacts only.
     """
 
-    def __init__(self, state_dir):
-        self.conn = sqlite3.connect(path.join(state_dir, 'datastore.sqlite'),
-                                    check_same_thread=False)
+    def __init__(self, state_dir, clock=REAL):
+        """
+        :param state_dir: Dir holding the datastore, None for in memory.
+        :type state_dir: str.
+        :param clock: Source of the loop that flushes run on.
+        :type clock: :class:`~common.Clock`
+        """
+        if state_dir is None:
+            db_path = ':memory:'
+        else:
+            db_path = path.join(state_dir, 'datastore.sqlite')
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = Lock()
+        self._pending = {}  # {(ip, port): (insert, contact) or None}
+        self._pending_lock = Lock()
+        self._woken = False
+        self._closed = False
         cur = self.conn.cursor()
+        cur.execute('PRAGMA journal_mode=WAL')
+        cur.execute('PRAGMA synchronous=NORMAL')
         cur.executescript(INITSTATEMENT)
+        cur.execute('PRAGMA table_info(swarm)')
+        columns = set(x[1] for x in cur.fetchall())
+        for name, decl in SWARM_MIGRATIONS:
+            if name not in columns:
+                cur.execute('ALTER TABLE swarm ADD COLUMN %s %s'
+                            % (name, decl))
+        cur.execute('CREATE INDEX IF NOT EXISTS swarm_seen '
+                    'ON swarm(last_seen)')
         self.conn.commit()
         cur.close()
+        self._loop = clock.loop()
+        self._loop.call_later(FLUSH_SEC, self._writer)
+        _open.add(self)
+
+    def close(self):
+        """
+        Writes the queued changes and closes the db.
+        Nothing else may be called on it afterwards.
+        """
+        _open.discard(self)
+        self.flush()
+        with self._lock:
+            self._closed = True
+            self.conn.close()
 
     def contacts(self):
         """
         :returns: All contacts in the db.
         :rtype: [:class:`common.Contact`]
         """
+        self.flush()
         statement = 'SELECT ip, port, hash FROM swarm'
-        cur = self.conn.cursor()
-        cur.execute(statement)
+        with self._lock:
+            cur = self.conn.cursor()
+            cur.execute(statement)
+            rows = cur.fetchall()
+            cur.close()
         return list(map(lambda x: Contact(Address(x[0], x[1]),
                                           Hash(x[2])),
-                        cur.fetchall()))
-        cur.close()
+                        rows))
+
+    def recent_contacts(self, own_hash, per_bucket):
+        """
+        Loads the contacts most worth seeding the routing table with:
+        at most `per_bucket` for every shared prefix length with
+        `own_hash`, the most recently seen (then lowest ping) first.
+        Rows past the cap are never turned into contacts.
+
+        :param own_hash: Our own hash.
+        :type own_hash: :class:`common.Hash`
+        :param per_bucket: Max contacts for any one prefix length.
+        :type per_bucket: int.
+        :returns: The selected contacts, with last_seen and ping restored,
+            least recently seen first (the order buckets keep them in).
+        :rtype: [:class:`common.Contact`]
+        """
+        self.flush()
+        statement = ('SELECT ip, port, hash, last_seen, ping FROM swarm '
+                     'ORDER BY last_seen DESC, ping ASC')
+        with self._lock:
+            cur = self.conn.cursor()
+            cur.execute(statement)
+            rows = cur.fetchall()
+            cur.close()
+        own = int(own_hash)
+        bits = len(own_hash) * 8
+        counts = {}
+        contacts = list()
+        for ip, port, h, seen, ping in rows:
+            if len(h) != len(own_hash):
+                continue
+            prefix = bits - (int.from_bytes(h, 'big') ^ own).bit_length()
+            n = counts.get(prefix, 0)
+            if n >= per_bucket:
+                continue
+            counts[prefix] = n + 1
+            contact = Contact(Address(ip, port), Hash(h))
+            if seen:
+                contact.last_seen = datetime.fromtimestamp(seen)
+            contact.ping = ping
+            contacts.append(contact)
+        contacts.reverse()
+        return contacts
+
+    def _queue(self, contact, change):
+        with self._pending_lock:
+            self._pending[contact.address.tuple] = change
+            wake = len(self._pending) >= FLUSH_MAX and not self._woken
+            if wake:
+                self._woken = True
+        if wake:
+            self._loop.post(self._flush_queued)
 
     def add_contact(self, contact):
         """
-        Adds a contact to the db.
+        Queues a contact to be added to (or updated in) the db.
 
         :param contact: Contact to add.
         :type contact: [:class:`common.Contact`]
         """
-        statement = 'INSERT INTO swarm(ip, port, hash) VALUES(?,?,?)'
-        cur = self.conn.cursor()
-        cur.execute(statement, (contact.address.ip,
-                                contact.address.port,
-                                contact.hash.value))
-        self.conn.commit()
-        cur.close()
+        self._queue(contact, (True, contact))
 
     def rm_contact(self, contact):
         """
-        Removes a contact from the db.
+        Queues a contact to be removed from the db.
 
         :param contact: Contact to remove.
         :type contact: [:class:`common.Contact`]
         """
-        statement = 'DELETE FROM swarm WHERE ip=? and port=?'
-        cur = self.conn.cursor()
-        cur.execute(statement, contact.address.tuple)
-        self.conn.commit()
-        cur.close()
+        self._queue(contact, None)
+
+    def touch_contact(self, contact):
+        """
+        Queues a refresh of a stored contact's last_seen and ping.
+        Does nothing for contacts that are not in the db.
+
+        :param contact: Contact that was seen.
+        :type contact: [:class:`common.Contact`]
+        """
+        with self._pending_lock:
+            if contact.address.tuple not in self._pending:
+                self._pending[contact.address.tuple] = (False, contact)
+
+    def flush(self):
+        """
+        Writes all queued swarm changes in one transaction.
+        """
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if len(pending) == 0:
+            return
+        upserts = []
+        touches = []
+        removes = []
+        for (ip, port), change in pending.items():
+            if change is None:
+                removes.append((ip, port))
+                continue
+            insert, contact = change
+            if contact.hash is None:
+                continue
+            seen = contact.last_seen.timestamp()
+            if insert:
+                upserts.append((ip, port, contact.hash.value,
+                                seen, contact.ping))
+            else:
+                touches.append((seen, contact.ping, ip, port))
+        with self._lock:
+            with self.conn:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO swarm'
+                    '(ip, port, hash, last_seen, ping) '
+                    'VALUES(?,?,?,?,?)', upserts)
+                self.conn.executemany(
+                    'UPDATE swarm SET last_seen=?, ping=? '
+                    'WHERE ip=? and port=?', touches)
+                self.conn.executemany(
+                    'DELETE FROM swarm WHERE ip=? and port=?', removes)
+
+    def _flush_queued(self):
+        if self._closed:
+            return
+        with self._pending_lock:
+            self._woken = False
+        try:
+            self.flush()
+        except sqlite3.Error:
+            get_logger(__name__).exception("Swarm flush failed")
+
+    def _writer(self):
+        """
+        Flushes the queued changes and schedules the next flush.
+        """
+        if self._closed:
+            return
+        self._loop.call_later(FLUSH_SEC, self._writer)
+        self._flush_queued()
 
     @property
     def friends(self):
@@ -81,14 +275,16 @@ class dbinterface():
 
     def add_friend(self, friend):
         statement = 'INSERT INTO friends(publickey, nickname) VALUES(?,?)'
-        cur = self.conn.cursor()
-        cur.execute(statement, (friend.pubkey, friend.nick))
-        self.conn.commit()
-        cur.close()
+        with self._lock:
+            cur = self.conn.cursor()
+            cur.execute(statement, (friend.pubkey, friend.nick))
+            self.conn.commit()
+            cur.close()
 
     def rm_friend(self, friend):
         statement = 'DELETE FROM friends WHERE publickey=? and nickname=?'
-        cur = self.conn.cursor()
-        cur.execute(statement, (friend.pubkey, friend.nick))
-        self.conn.commit()
-        cur.close()
+        with self._lock:
+            cur = self.conn.cursor()
+            cur.execute(statement, (friend.pubkey, friend.nick))
+            self.conn.commit()
+            cur.close()
@@ -84,14 +84,18 @@ class AESCrypto(CryptoModule):
 
             :attr:`~crypto.aesgcm.TAG_SIZE`
 
+        The payload is read straight from the data,
+        so a :class:`memoryview` of a packet is decrypted without copying.
+
         :param data: The raw data to decrypt
-        :type data: bytes
+        :type data: bytes-like
         :returns: Decrypted data
         :rtype: bytes
         """
-        iv = data[:IV_SIZE]
+        data = memoryview(data)
+        iv = bytes(data[:IV_SIZE])
         payload = data[IV_SIZE: -TAG_SIZE]
-        tag = data[-TAG_SIZE:]
+        tag = bytes(data[-TAG_SIZE:])
 
         decryptor = Cipher(
             algorithms.AES(self.key),
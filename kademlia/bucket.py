@@ -1,19 +1,51 @@
-from datetime import datetime
+from os import urandom
+from threading import RLock
+import heapq
 
-from common import Event, List as list
+from common import Event, Hash, List as list
 from common import btlxlogger as logger
+from common.clock import REAL
 
 Logger = logger.get(__name__)
 
 
+def proximity_key(contact, distance):
+    """
+    Sort key for proximity mode.
+    Contacts whose distance shares the same most significant bit
+    are treated as equally close, and ordered by
+    :attr:`~common.Contact.cost` between themselves.
+
+    :param contact: The contact.
+    :type contact: :class:`common.Contact`
+    :param distance: Its distance to the target.
+    :type distance: :class:`common.hash.Distance`
+    """
+    return (distance.significant_bit(), contact.cost, distance)
+
+
 class Bucket:
     """
+    A least-recently-seen ordered list of contacts.
+
+    Contacts that are seen again move to the tail,
+    so the head is always the one we know least about.
+    When a full bucket sees a newcomer, the newcomer goes into the
+    waitlist (the replacement cache) and the head is probed with a ping.
+    If the head answers it moves to the tail and stays,
+    otherwise it is evicted and the freshest waitlisted contact
+    is promoted in its place.
+
     .. attribute:: contacts
 
-        :class:`list` of len :attr:`kademlia.K`
+        :class:`list` of len :attr:`kademlia.K`, oldest first
     .. attribute:: waitlist
 
-        :class:`list` of len :attr:`kademlia.K`
+        :class:`list` of len :attr:`kademlia.K`, oldest first
+    .. attribute:: last_seen
+
+        Last time there was activity (an update or a lookup)
+        in the range of this bucket.
     .. attribute:: on_added
 
         Event(:class:`common.Event`)
@@ -22,12 +54,22 @@ class Bucket:
         Event(:class:`common.Event`)
     """
 
-    def __init__(self, K):
+    def __init__(self, K, clock=REAL, lock=None):
+        """
+        :param lock: Writer lock shared with the rest of the routing table.
+            Held by contact deaths, which come in from other threads.
+        :type lock: :class:`threading.RLock`
+        """
         self.K = K
+        self._clock = clock
+        self._lock = RLock() if lock is None else lock
         self.contacts = list()
         self.waitlist = list()
+        self.last_seen = clock.now()
         self.on_added = Event('Bucket.on_added')
         self.on_removed = Event('Bucket.on_removed')
+        #: (contact, sent time) of the outstanding probe
+        self._probe = None
 
     def update(self, contact, report=True):
         """
@@ -36,66 +78,287 @@ class Bucket:
         :param contact: Newly seen contact.
         :type contact: :class:`common.Contact`
         :param report: Pop the :func:`~common.Bucket.on_added` event or not.
+        :returns: A contact that should be pinged to see if it is
+            still alive, or None.
+            Left to the caller, so the ping is not sent under the lock.
+        :rtype: :class:`common.Contact`
         """
-        if contact not in self.contacts:
-            if (len(self.contacts) <= self.K):
-                self.contacts.append(contact)
-                contact.on_death += self.contact_death
-                if (report):
-                    self.on_added(contact)
-            elif ((len(self.waitlist) <= self.K)
-                    and (contact not in self.waitlist)):
-                self.waitlist.append(contact)
-                contact.on_death += self.waitlist_death
+        self.last_seen = self._clock.now()
+        if contact in self.contacts:
+            # Seen again, so it becomes the most recently seen
+            self.contacts.remove(contact)
+            self.contacts.append(contact)
+            if self._probe is not None and self._probe[0] is contact:
+                self._probe = None
+        elif not self.is_full:
+            self._add(contact, report)
+        else:
+            self._add_waitlist(contact)
+            return self._check_probe(report)
+
+    def _add(self, contact, report):
+        self.contacts.append(contact)
+        contact.on_death += self.contact_death
         if report:
             self.on_added(contact)
 
+    def _add_waitlist(self, contact):
+        if contact in self.waitlist:
+            self.waitlist.remove(contact)
+        else:
+            contact.on_death += self.waitlist_death
+        self.waitlist.append(contact)
+        # Drop the stalest replacement if we are over
+        if len(self.waitlist) > self.K:
+            self.waitlist_death(self.waitlist[0])
+
+    def _check_probe(self, report):
+        """
+        Probes the least recently seen contact,
+        or evicts it if the last probe went unanswered.
+
+        :returns: The contact to probe, or None.
+        """
+        now = self._clock.now()
+        if self._probe is not None:
+            contact, sent = self._probe
+            # Magic Number [1000]: convert seconds to ms
+            waited = (now - sent).total_seconds() * 1000
+            if waited < contact.ping * PROBE_MULT:
+                return None
+            Logger.debug("Evicting unresponsive %s" % contact)
+            self._probe = None
+            self._remove(contact)
+            self._promote(report)
+            if self.is_full:
+                return self._check_probe(report)
+            return None
+        else:
+            head = self.contacts[0]
+            self._probe = (head, now)
+            return head
+
+    def _remove(self, contact):
+        self.contacts.remove(contact)
+        contact.on_death -= self.contact_death
+        self.on_removed(contact)
+
+    def _promote(self, report=True):
+        """
+        Moves the most recently seen waitlisted contact into the bucket.
+        """
+        if len(self.waitlist) > 0 and not self.is_full:
+            replacement = self.waitlist.pop()
+            replacement.on_death -= self.waitlist_death
+            self._add(replacement, report)
+
+    @property
+    def is_full(self):
+        """
+        :returns: If the bucket holds K contacts.
+        :rtype: bool.
+        """
+        return len(self.contacts) >= self.K
+
+    def split(self, goes_deeper):
+        """
+        Moves the contacts matching a conditional into a new bucket.
+        No events are fired, as the contacts stay in the routing table.
+
+        :param goes_deeper: Conditional for contacts that should move.
+        :returns: The new bucket.
+        :rtype: :class:`kademlia.bucket.Bucket`
+        """
+        deeper = Bucket(self.K, self._clock, self._lock)
+        deeper.last_seen = self.last_seen
+        deeper.contacts, self.contacts = self.contacts.split(goes_deeper)
+        deeper.waitlist, self.waitlist = self.waitlist.split(goes_deeper)
+        for contact in deeper.contacts:
+            contact.on_death -= self.contact_death
+            contact.on_death += deeper.contact_death
+        for contact in deeper.waitlist:
+            contact.on_death -= self.waitlist_death
+            contact.on_death += deeper.waitlist_death
+        if self._probe is not None and self._probe[0] in deeper.contacts:
+            deeper._probe, self._probe = self._probe, None
+        return deeper
+
     def contact_death(self, contact):
         """
         Event handler for when a contact expires that is in a list.
+        Promotes a waitlisted contact into the free slot.
 
         :param contact: Dieing contact.
         :type contact: :class:`common.Contact`
         """
-        if contact in self.contacts:
-            self.contacts.remove(contact)
-            contact.on_death -= self.contact_death
-            self.on_removed(contact)
-        if len(self.waitlist) > 0:
-            replacement = self.waitlist[len(self.waitlist) - 1]
-            self.contacts.append(replacement)
-            self.waitlist.on_death += self.contact_death
-            self.waitlist.remove(replacement)
-            self.waitlist.on_death -= self.waitlist_death
+        with self._lock:
+            if contact in self.contacts:
+                if self._probe is not None and self._probe[0] is contact:
+                    self._probe = None
+                self._remove(contact)
+                self._promote()
 
     def waitlist_death(self, contact):
         """
         Event fired if a contact on the waitlist dies.
         """
-        if contact in self.waitlist:
-            self.waitlist.remove(contact)
-            contact.on_death -= self.waitlist_death
+        with self._lock:
+            if contact in self.waitlist:
+                self.waitlist.remove(contact)
+                contact.on_death -= self.waitlist_death
+
 
 CHECK_MIN = 1.5
-"""How often to check for dead clients."""
+"""How often to check for dead clients and stale buckets."""
+REFRESH_MIN = 15
+"""Minutes a bucket may go without activity before it is refreshed."""
+PROBE_MULT = 5
+"""Multiple of a contact's ping to wait for a probe answer before evicting."""
 DEL_MIN = 10
 """Minutes of staleness allowed for clients."""
 
 
+class Snapshot():
+    """
+    An immutable view of the routing table,
+    as of one :attr:`~kademlia.Buckets.generation`.
+    Readers work from one of these without taking any lock,
+    while writers keep changing the buckets underneath.
+
+    Contacts within a bucket keep the order they had
+    when the snapshot was taken.
+
+    .. attribute:: buckets
+
+        Tuple of the contacts of every bucket (as tuples),
+        ordered by shared prefix length with our hash.
+    .. attribute:: own_contact
+
+        Our own contact, if it has been seen.
+    .. attribute:: generation
+
+        The generation of the routing table this was taken at.
+    """
+
+    def __init__(self, own_hash, B, proximity, buckets, own_contact,
+                 generation):
+        self.own_hash = own_hash
+        self.B = B
+        self.proximity = proximity
+        self.buckets = buckets
+        self.own_contact = own_contact
+        self.generation = generation
+
+    def __len__(self):
+        own = 0 if self.own_contact is None else 1
+        return own + sum(map(len, self.buckets))
+
+    def index(self, hash):
+        """
+        :returns: The index of the bucket that a hash belongs in.
+        :rtype: int.
+        """
+        prefix = self.B - (self.own_hash ^ hash).significant_bit()
+        return min(prefix, len(self.buckets) - 1)
+
+    def get_exact(self, hash):
+        """
+        :param hash: The hash to retreive.
+        :type hash: :class:`common.Hash`
+        :returns: The contact, or None if it is not in the buckets.
+        :rtype: :class:`common.Contact`
+        """
+        if hash == self.own_hash:
+            return self.own_contact
+        for contact in self.buckets[self.index(hash)]:
+            if contact.hash == hash:
+                return contact
+        return None
+
+    def _distance_bands(self, index):
+        """
+        Walks the buckets outward from the bucket a target falls in.
+
+        Every contact in a yielded list is strictly closer to the target
+        than any contact in a later list, so only the last band that is
+        needed has to be partially sorted.
+
+        :param index: Bucket index of the target.
+        :type index: int.
+        """
+        yield self.buckets[index]
+        # Deeper buckets all differ from the target at the same bit
+        # (the first one it does not share with us), so they are pooled.
+        if index < len(self.buckets) - 1:
+            yield [contact for bucket in self.buckets[index + 1:]
+                   for contact in bucket]
+        # Shallower buckets differ at their own bit, one band each.
+        for bucket in reversed(self.buckets[:index]):
+            yield bucket
+
+    def get_closest(self, hash, count):
+        """
+        Gets the closest n contacts to a hash, sorted by XOR distance.
+        Our own contact is never included.
+        In proximity mode the same contacts are returned, but the ones
+        at similar distance are ordered cheapest first.
+
+        :param hash: The hash to compare to.
+        :type hash: :class:`common.Hash`
+        :param count: Number of contacts to return.
+        :type count: int.
+        """
+        key = lambda x: x.hash ^ hash
+        contacts = list()
+
+        for band in self._distance_bands(self.index(hash)):
+            needed = count - len(contacts)
+            if len(band) < needed:
+                contacts += sorted(band, key=key)
+            else:
+                contacts += heapq.nsmallest(needed, band, key=key)
+                break
+        if self.proximity:
+            contacts.sort(key=lambda x: proximity_key(x, x.hash ^ hash))
+        Logger.debug("GET_CLOSEST ret: %s" % contacts)
+        return contacts
+
+
 class Buckets():
     """
     Primary interface to the list of :class:`kademlia.Bucket`.
 
+    The buckets form a Kademlia routing tree that only splits
+    down the branch holding our own hash.
+    Bucket `i` holds the contacts sharing exactly `i` leading bits
+    with our hash, except for the last one, which holds everything
+    that shares at least that many.
+    When the last bucket is full it is split in two,
+    so the amount of buckets grows with the known contacts
+    (roughly log2 of them) instead of with the key size.
+
+    Writers (updates, seeding, contact deaths) are serialized
+    on one lock, so packets can be handled from several threads.
+    Lookups read from a :class:`~kademlia.bucket.Snapshot`
+    that is only rebuilt once the generation has moved on,
+    so they neither take the lock nor see a half-done change.
+
     .. attribute:: _buckets
 
-        A list of buckets `~kademlia.K` big.
+        The buckets, ordered by shared prefix length with our hash.
+    .. attribute:: _own_contact
+
+        Our own contact, if it has been seen.
+        Kept out of the buckets so it never takes a slot.
     .. attribute:: _conns
 
         All currently alive seen connections.
         {:class:`~common.Address`: :class:`~common.Contact`}
-    .. attribute:: _last_check
+    .. attribute:: generation
 
-        Last time that the _conns we checked for liveliness.
+        Counter bumped whenever a contact joins or leaves the buckets
+        (or they split), so answers worked out from them
+        can tell they are stale.
     .. attribute:: on_added
 
         Event called when a new contact is added to a bucket.
@@ -104,9 +367,15 @@ class Buckets():
 
         Event called when a contact is removed from bucket.
         Event(:class:`~common.Client`)
+    .. attribute:: on_probe
+
+        Event called when a contact should be pinged
+        before it is evicted.
+        Fired after the lock is released, as the ping does network I/O.
+        Event(:class:`~common.Client`)
     """
 
-    def __init__(self, own_hash, K, B):
+    def __init__(self, own_hash, K, B, clock=REAL, proximity=False):
         """
         :param own_hash: Our own hash
         :type own_hash: :class:`~common.Hash`
@@ -114,23 +383,80 @@ class Buckets():
         :type K: int.
         :param B: Key size
         :type B: int.
+        :param clock: Time source for bucket activity and probes.
+        :type clock: :class:`~common.Clock`
+        :param proximity: Order :func:`get_closest` results
+            with :func:`~kademlia.bucket.proximity_key`.
+        :type proximity: bool.
         """
         self.K = K
         self.B = B
+        self.proximity = proximity
+        self._clock = clock
         self.own_hash = own_hash
-        self._last_check = datetime.now()
         self.on_added = Event('Buckets.on_added')
         self.on_removed = Event('Buckets.on_removed')
-        # B+1 buckets because 0 means perfect match
-        # 1-320 represent the bit level difference (index + 1)
-        self._buckets = [Bucket(K) for i in range(self.B + 1)]
-        for bucket in self._buckets:
-            bucket.on_added += self.on_added
-            bucket.on_removed += self.on_removed
+        self.on_probe = Event('Buckets.on_probe')
+        self._own_contact = None
+        self._lock = RLock()
+        self.generation = 0
+        self._buckets = []
+        self._add_bucket(Bucket(K, clock, self._lock))
+        self._snapshot = self._take_snapshot()
         self._conns = {}
 
     def __len__(self):
-        return sum(map(lambda x: len(x.contacts), self._buckets))
+        return len(self.snapshot)
+
+    @property
+    def snapshot(self):
+        """
+        :returns: The routing table as of the latest generation.
+        :rtype: :class:`~kademlia.bucket.Snapshot`
+        """
+        snapshot = self._snapshot
+        if snapshot.generation == self.generation:
+            return snapshot
+        # Waits out a writer that is midway through a change
+        with self._lock:
+            if self._snapshot.generation != self.generation:
+                self._snapshot = self._take_snapshot()
+            return self._snapshot
+
+    def _take_snapshot(self):
+        return Snapshot(self.own_hash, self.B, self.proximity,
+                        tuple(tuple(x.contacts) for x in self._buckets),
+                        self._own_contact, self.generation)
+
+    def _add_bucket(self, bucket):
+        bucket.on_added += self.on_added
+        bucket.on_removed += self._on_removed
+        bucket.on_removed += self.on_removed
+        self._buckets.append(bucket)
+
+    def _index(self, hash):
+        """
+        :returns: The index of the bucket that a hash belongs in.
+        :rtype: int.
+        """
+        prefix = self.B - (self.own_hash ^ hash).significant_bit()
+        return min(prefix, len(self._buckets) - 1)
+
+    def _split(self):
+        """
+        Splits the last bucket (the one covering our own hash).
+        Contacts sharing more than its prefix move to a new last bucket.
+        """
+        depth = len(self._buckets)
+        own_bit = self.B - depth
+        self._add_bucket(self._buckets[-1].split(
+            lambda x: (x.hash ^ self.own_hash).significant_bit()
+            <= own_bit))
+        self.generation += 1
+        Logger.debug("Split to %d buckets" % len(self._buckets))
+
+    def _on_removed(self, contact):
+        self.generation += 1
 
     def seed(self, contacts):
         """
@@ -140,19 +466,94 @@ class Buckets():
         :param contacts: The contacts to add.
         :type contacts: [:class:`common.Contact`]
         """
-        for contact in contacts:
-            self.update(contact, False)
+        with self._lock:
+            probes = [self._update(contact, False) for contact in contacts]
+        for contact in probes:
+            if contact is not None:
+                self.on_probe(contact)
 
     def update(self, contact, report=True):
         """
         Updates a contact within the correct bucket.
+        Splits the bucket covering our own hash if it is full.
 
         :param contact: The seen contact.
         :type contact: :class:`common.Contact`
         :param report: Pop the :func:`~common.Bucket.on_added` event or not.
         """
-        loc = (contact.hash ^ self.own_hash).significant_bit()
-        self._buckets[loc].update(contact, report)
+        with self._lock:
+            probe = self._update(contact, report)
+        if probe is not None:
+            self.on_probe(probe)
+
+    def _update(self, contact, report):
+        """
+        :func:`update` with the lock held.
+
+        :returns: The contact to probe, or None.
+        """
+        if contact.hash == self.own_hash:
+            if self._own_contact is not contact:
+                self._own_contact = contact
+                self.generation += 1
+            return None
+        loc = self._index(contact.hash)
+        while (loc == len(self._buckets) - 1 and loc < self.B
+               and self._buckets[loc].is_full
+               and contact not in self._buckets[loc].contacts):
+            self._split()
+            loc = self._index(contact.hash)
+        bucket = self._buckets[loc]
+        size = len(bucket.contacts)
+        probe = bucket.update(contact, report)
+        # Only a newcomer changes what get_closest can return,
+        # evictions are counted by _on_removed.
+        if len(bucket.contacts) != size:
+            self.generation += 1
+        return probe
+
+    def touch(self, hash):
+        """
+        Marks activity in the bucket that a hash falls in.
+        Called when a lookup is started so its range is not refreshed.
+
+        :param hash: The hash that was looked up.
+        :type hash: :class:`common.Hash`
+        """
+        with self._lock:
+            self._buckets[self._index(hash)].last_seen = self._clock.now()
+
+    def stale(self, before):
+        """
+        :param before: Buckets with no activity since this are stale.
+        :type before: :class:`datetime.datetime`
+        :returns: Indices of the stale buckets, stalest first.
+        :rtype: [int.]
+        """
+        with self._lock:
+            seen = [bucket.last_seen for bucket in self._buckets]
+        indices = [i for i, x in enumerate(seen) if x < before]
+        return sorted(indices, key=lambda i: seen[i])
+
+    def random_hash(self, index):
+        """
+        Makes a random hash that falls in a given bucket.
+        Used as the target for refresh lookups.
+
+        :param index: The index of the bucket.
+        :type index: int.
+        :rtype: :class:`common.Hash`
+        """
+        own = int(self.own_hash)
+        free_bits = self.B - index
+        prefix = (own >> free_bits) << free_bits
+        rand = int.from_bytes(urandom(len(self.own_hash)), 'big')
+        rand &= (1 << free_bits) - 1
+        # Every bucket but the last must differ at the next bit
+        if index < len(self.snapshot.buckets) - 1:
+            flip = 1 << (free_bits - 1)
+            rand = (rand & ~flip) | (~own & flip)
+        return Hash.from_int(prefix | rand, len(self.own_hash))
 
     def get_exact(self, hash, use_waitlist=False):
         """
@@ -163,18 +564,19 @@ class Buckets():
         :param use_waitlist: Search through the waitlists as well.
         :type use_waitlist: bool.
         """
-        significant_bit = (self.own_hash ^ hash).significant_bit()
         if not use_waitlist:
-            return self._buckets[significant_bit]\
-                .contacts.first(lambda x: x.hash == hash)
-        else:
-            return (self._buckets[significant_bit].contacts +
-                    self._buckets[significant_bit].waitlist)\
+            return self.snapshot.get_exact(hash)
+        with self._lock:
+            if hash == self.own_hash and self._own_contact is not None:
+                return self._own_contact
+            bucket = self._buckets[self._index(hash)]
+            return list(bucket.contacts + bucket.waitlist)\
                 .first(lambda x: x.hash == hash)
 
     def get_closest(self, hash, count=None):
         """
-        Gets the closest n contacts to a hash.
+        Gets the closest n contacts to a hash, sorted by XOR distance.
+        Read from the current :attr:`snapshot`.
 
         :param hash: The hash to compare to.
         :type hash: :class:`common.Hash`
@@ -183,19 +585,4 @@ class Buckets():
         """
         if count is None:
             count = self.K
-        targethash = (self.own_hash ^ hash)
-        significant_bit = targethash.significant_bit()
-        contacts = list()
-
-        # Sorted Indices (for prox to the contact).
-        # Ignore the one that is its own bucket to avoid any recursion.
-        si = sorted([x for x in range(1, self.B + 1)],
-                    key=lambda x: abs(x - significant_bit))
-
-        for dindex in si:
-            contacts += self._buckets[dindex].contacts
-            if (len(contacts) >= count):
-                return sorted(contacts, key=lambda x:
-                              targethash.AbsDiff(self.own_hash ^ x.hash))[:count]
-        Logger.debug("GET_CLOSEST ret: %s" % contacts)
-        return contacts
+        return self.snapshot.get_closest(hash, count)
@@ -0,0 +1,212 @@
+from collections import OrderedDict
+from threading import Lock
+
+from common.clock import REAL
+
+CACHE_SIZE = 256
+"""Most lookup results kept at once."""
+CACHE_TTL = 60
+"""Seconds a lookup result is served from the cache."""
+RESPONSE_CACHE_SIZE = 256
+"""Most encoded search answers kept at once."""
+RESPONSE_PREFIX = 8
+"""
+Leading bytes of a target that key its cached answer,
+so targets sharing them get the same answer.
+This is an approximation: the order of two contacts only depends
+on these bytes if the contacts differ within them.
+Should two contacts in the buckets share them, the answer may be
+ordered for another target with the same prefix,
+which a search takes in its stride like any stale answer.
+"""
+
+
+class LookupCache():
+    """
+    Bounded, least-recently-used cache of finished lookups.
+
+    Results expire after :attr:`~kademlia.cache.CACHE_TTL` seconds,
+    and are dropped early if any contact in them leaves the buckets.
+
+    .. attribute:: hits
+
+        Lookups answered from the cache.
+    .. attribute:: misses
+
+        Lookups that had to go out to the network.
+    """
+
+    def __init__(self, size=CACHE_SIZE, ttl=CACHE_TTL, clock=REAL):
+        """
+        :param size: Most results to keep.
+        :type size: int.
+        :param ttl: Seconds a result stays valid.
+        :type ttl: float
+        :param clock: Time source for expiry.
+        :type clock: :class:`~common.Clock`
+        """
+        self.size = size
+        self._clock = clock
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()  # {target: (expires, SearchResult)}
+        self._by_contact = {}  # {contact hash: set(target)}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, hash_):
+        """
+        :param hash_: The target of the lookup.
+        :type hash_: :class:`~common.Hash`
+        :returns: The cached result, or None on a miss.
+        :rtype: :attr:`~kademlia.shortlist.SearchResult`
+        """
+        with self._lock:
+            try:
+                expires, result = self._results[hash_]
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires <= self._clock.monotonic():
+                self._drop(hash_)
+                self.misses += 1
+                return None
+            self._results.move_to_end(hash_)
+            self.hits += 1
+            return result
+
+    def put(self, hash_, result):
+        """
+        Stores the result of a finished lookup.
+
+        :param hash_: The target of the lookup.
+        :type hash_: :class:`~common.Hash`
+        :param result: The result to store.
+        :type result: :attr:`~kademlia.shortlist.SearchResult`
+        """
+        with self._lock:
+            self._drop(hash_)
+            self._results[hash_] = (self._clock.monotonic() + self.ttl, result)
+            for contact in self._contacts(result):
+                self._by_contact.setdefault(contact.hash, set()).add(hash_)
+            while len(self._results) > self.size:
+                self._drop(next(iter(self._results)))
+
+    def invalidate(self, contact):
+        """
+        Event handler for when a contact leaves the buckets.
+        Drops every result that contains it.
+
+        :param contact: The removed contact.
+        :type contact: :class:`~common.Contact`
+        """
+        with self._lock:
+            for hash_ in list(self._by_contact.get(contact.hash, ())):
+                self._drop(hash_)
+
+    def _contacts(self, result):
+        if result.found is not None:
+            yield result.found
+        yield from result.closest
+
+    def _drop(self, hash_):
+        entry = self._results.pop(hash_, None)
+        if entry is None:
+            return
+        for contact in self._contacts(entry[1]):
+            targets = self._by_contact.get(contact.hash)
+            if targets is not None:
+                targets.discard(hash_)
+                if len(targets) == 0:
+                    del(self._by_contact[contact.hash])
+
+
+class ResponseCache():
+    """
+    Bounded, least-recently-used cache of the answers to node searches.
+
+    Holds the closest contacts to a target, each already encoded,
+    so a repeated search skips both :func:`~kademlia.Buckets.get_closest`
+    and the encoding of the node list.
+    Everything is dropped as soon as the routing table's
+    :attr:`~kademlia.Buckets.generation` moves on.
+    A miss is worked out from the routing table's snapshot
+    without holding the cache's lock, so concurrent searches
+    are not served one at a time.
+
+    .. attribute:: hits
+
+        Searches answered from the cache.
+    .. attribute:: misses
+
+        Searches that had to be worked out from the buckets.
+    """
+
+    def __init__(self, buckets, nodes_tag, count, size=RESPONSE_CACHE_SIZE):
+        """
+        :param buckets: The routing table answers come from.
+        :type buckets: :class:`~kademlia.Buckets`
+        :param nodes_tag: Tag that encodes the node lists.
+        :type nodes_tag: :class:`~net.tag.NodeListTag`
+        :param count: Contacts to keep per answer.
+        :type count: int.
+        :param size: Most answers to keep.
+        :type size: int.
+        """
+        self.size = size
+        self.count = count
+        self.hits = 0
+        self.misses = 0
+        self._buckets = buckets
+        self._nodes_tag = nodes_tag
+        self._generation = buckets.generation
+        self._answers = OrderedDict()  # {prefix: [(Contact, NodeRecord)]}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._answers)
+
+    def get(self, hash_):
+        """
+        :param hash_: The target of the search.
+        :type hash_: :class:`~common.Hash`
+        :returns: The closest contacts, each with its record,
+            closest first.
+        :rtype: [(:class:`~common.Contact`, :class:`~net.tag.NodeRecord`)]
+        """
+        key = hash_.value[:RESPONSE_PREFIX]
+        snapshot = self._buckets.snapshot
+        with self._lock:
+            self._sync(snapshot.generation)
+            answer = self._answers.get(key)
+            if answer is not None:
+                self._answers.move_to_end(key)
+                self.hits += 1
+                return answer
+            self.misses += 1
+        # Walked outside the lock, so searches are not served one at
+        # a time. Two misses on one key both walk, the first one is kept.
+        answer = [(x, self._nodes_tag.record(x)) for x in
+                  snapshot.get_closest(hash_, self.count)]
+        with self._lock:
+            self._sync(snapshot.generation)
+            # The table moved on while walking, the answer is too old
+            if self._generation != snapshot.generation:
+                return answer
+            answer = self._answers.setdefault(key, answer)
+            if len(self._answers) > self.size:
+                self._answers.popitem(last=False)
+            return answer
+
+    def _sync(self, generation):
+        """
+        Drops every answer once the routing table's generation
+        moves past the one they were worked out for.
+        Called with the lock held.
+        """
+        if self._generation < generation:
+            self._generation = generation
+            self._answers.clear()
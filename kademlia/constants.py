@@ -2,6 +2,8 @@
 K = 20
 #: Level of paralellism for DHT searches
 A = 3
+#: Prefer cheap (low ping, lively) contacts among ones at similar distance
+PROXIMITY = False
 # TODO: Tie this into state
 #: Keysize
 B = 320
@@ -1,8 +1,16 @@
 #!/usr/bin/python3
+import asyncio
+from concurrent.futures import Future
+
 from .bucket import Buckets
-from .shortlist import Shortlists
+from .cache import LookupCache, ResponseCache
+from .shortlist import Shortlists, SearchResult
+from .store import RecordStore, Republisher, RECORD_TTL, MAX_VALUE_SIZE
+from .refresh import Refresher
+from .constants import PROXIMITY
 from common import dbinterface
 from common import btlxlogger as logger
+from common.clock import REAL
 
 Logger = logger.get('kademlia')
 
@@ -20,43 +28,77 @@ class Kademlia():
     .. attribute:: buckets
 
         The kademlia :class:`~kademlia.Buckets`
+    .. attribute:: refresher
+
+        The :class:`~kademlia.refresh.Refresher` for idle buckets
+    .. attribute:: cache
+
+        The :class:`~kademlia.cache.LookupCache` of finished searches
+    .. attribute:: responses
+
+        The :class:`~kademlia.cache.ResponseCache` of answers
+        to search requests
+    .. attribute:: records
+
+        The :class:`~kademlia.store.RecordStore` of DHT values held here
     .. db_conn
 
         Database handle :class:`common.dbinterface`
     """
 
-    def __init__(self, net, own_contact, dir_, K, B, A):
+    def __init__(self, net, own_contact, dir_, K, B, A, clock=REAL,
+                 proximity=PROXIMITY):
         """
         :param net:
         :type net: :class:`~net.BytelynxStack`
         :param own_contact:
         :type own_contact: :class:`~common.Contact`
-        :param dir_:
-        :type dir_:
+        :param dir_: State dir for the datastore, None to keep it in memory.
+        :type dir_: str.
         :param K: Bucket size
         :type K: int.
         :param B: Key size
         :type B: int.
         :param A: Paralellism
         :type A: int.
+        :param clock: Source of time and loops for all DHT work.
+        :type clock: :class:`~common.Clock`
+        :param proximity: Prefer cheap contacts among ones at similar
+            distance, when searching and when answering searches.
+        :type proximity: bool.
         """
-        self.db_conn = dbinterface(dir_)
+        self.db_conn = dbinterface(dir_, clock)
         self.net = net
         self.K = K
         self.own_contact = own_contact
 
-        self.shortlists = Shortlists(own_contact.hash, K, A)
+        self.shortlists = Shortlists(own_contact.hash, K, A, clock,
+                                     proximity)
         self.shortlists.on_search += self.send_search
         self.shortlists.on_full_or_found += self.end_search
 
-        self.buckets = Buckets(own_contact.hash, K, B)
+        self.cache = LookupCache(clock=clock)
+        self.records = RecordStore(clock)
+
+        self.buckets = Buckets(own_contact.hash, K, B, clock, proximity)
         self.buckets.on_added += self.db_conn.add_contact
         self.buckets.on_removed += self.db_conn.rm_contact
-        db_contacts = self.net.update_contacts(self.db_conn.contacts())
+        self.buckets.on_removed += self.cache.invalidate
+        self.buckets.on_probe += self.send_ping
+        db_contacts = self.net.update_contacts(
+            self.db_conn.recent_contacts(own_contact.hash, K))
 
         all_contacts = db_contacts + [own_contact]
         self.buckets.seed(all_contacts)
 
+        nodes_tag = self.net.protocol.messages['dht.response']\
+            .get_tag('nodes')
+        self.responses = ResponseCache(self.buckets, nodes_tag, K + 2)
+
+        self.refresher = Refresher(self.buckets, self.init_search,
+                                   clock=clock)
+        self.republisher = Republisher(self.records, self.store, clock)
+
         self._register_protocol()
 
     def _register_protocol(self):
@@ -65,6 +107,11 @@ class Kademlia():
         msgs = self.net.protocol.messages
         msgs['dht.search'].on_data += self.on_find_node_request
         msgs['dht.response'].on_data += self.on_find_node_response
+        msgs['dht.store'].on_data += self.on_store_request
+        msgs['dht.find_value'].on_data += self.on_find_value_request
+        msgs['dht.value'].on_data += self.on_find_value_response
+        msgs['dht.search.batch'].on_data += self.on_find_nodes_request
+        msgs['dht.response.batch'].on_data += self.on_find_nodes_response
 
     def dht_handler(self, contact):
         """
@@ -76,28 +123,86 @@ class Kademlia():
         """
         Logger.debug("DHT for %s" % contact)
         self.buckets.update(contact)
+        self.db_conn.touch_contact(contact)
 
     def on_find_node_request(self, contact, data):
         """
         Event handler for when a request for a node arrives.
         """
-        contacts = self.buckets.get_closest(data['payload']['hash'],
-                                            count=self.K + 2)
+        self._send_closest(contact, data['payload']['hash'])
+
+    def _closest(self, contact, hash_):
+        """
+        :returns: The encoded nodes to answer a search with.
+        :rtype: [:class:`~net.tag.NodeRecord`]
+        """
+        nodes = self.responses.get(hash_)
         # Filter out self and requesting contacts
-        contacts = [x for x in contacts
-                    if x != contact
-                    and x != self.own_contact][:self.K]
-        Logger.debug("Sending Contacts: %s" % contacts)
-        retData = {'hash': data['payload']['hash'], 'nodes': contacts}
+        nodes = [x for x in nodes
+                 if x[0] != contact
+                 and x[0] != self.own_contact][:self.K]
+        Logger.debug("Sending Contacts: %s" % [x[0] for x in nodes])
+        return [x[1] for x in nodes]
+
+    def _send_closest(self, contact, hash_):
+        retData = {'hash': hash_, 'nodes': self._closest(contact, hash_)}
         self.net.send_data(contact, 'dht.response', retData)
 
     def on_find_node_response(self, contact, data):
+        self._add_response(contact, data['payload']['hash'],
+                           data['payload']['nodes'])
+
+    def _add_response(self, contact, hash_, nodes):
         # Translate to 'real' contacts first
-        contacts = self.net.update_contacts(data['payload']['nodes'])
+        contacts = self.net.update_contacts(nodes)
         Logger.debug("Received Contacts: %s" % contacts)
-        self.shortlists.add_response(data['payload']['hash'],
-                                     contact.address,
-                                     contacts)
+        self.shortlists.add_response(hash_, contact.address, contacts)
+
+    def on_find_nodes_request(self, contact, data):
+        """
+        Event handler for a node search for several targets.
+        All of them are answered in one response.
+        """
+        hashes = data['payload']['hashes']
+        results = [self._closest(contact, x) for x in hashes]
+        self.net.send_data(contact, 'dht.response.batch',
+                           {'hashes': hashes, 'results': results})
+
+    def on_find_nodes_response(self, contact, data):
+        payload = data['payload']
+        for hash_, nodes in zip(payload['hashes'], payload['results']):
+            self._add_response(contact, hash_, nodes)
+
+    def on_store_request(self, contact, data):
+        """
+        Event handler for when a contact asks us to hold a value.
+        Values over :attr:`~kademlia.store.MAX_VALUE_SIZE` are dropped.
+        """
+        payload = data['payload']
+        if len(payload['value']) > MAX_VALUE_SIZE:
+            Logger.debug("Dropping %d byte value from %s" %
+                         (len(payload['value']), contact))
+            return
+        self.records.put(payload['hash'], payload['value'], payload['ttl'])
+
+    def on_find_value_request(self, contact, data):
+        """
+        Event handler for when a request for a value arrives.
+        Answers with the value if it is held here,
+        otherwise with the closest nodes like a node search.
+        """
+        hash_ = data['payload']['hash']
+        value = self.records.get(hash_)
+        if value is None:
+            self._send_closest(contact, hash_)
+        else:
+            self.net.send_data(contact, 'dht.value',
+                               {'hash': hash_, 'value': value})
+
+    def on_find_value_response(self, contact, data):
+        payload = data['payload']
+        self.shortlists.add_value(payload['hash'], contact.address,
+                                  payload['value'])
 
     def send_ping(self, contact):
         """
@@ -112,29 +217,135 @@ class Kademlia():
     def init_search(self, hash_):
         """
         Starts the searching fun on a shortlist.
+        Concurrent searches for the same hash share one shortlist,
+        and recently finished ones are answered from the cache.
 
         :param hash_: Hash to attempt to find.
         :type hash_: :class:`~common.Hash`
+        :returns: A future for the result of the search.
+        :rtype: :class:`concurrent.futures.Future`
+            (:attr:`~kademlia.shortlist.SearchResult`)
         """
+        cached = self.cache.get(hash_)
+        if cached is not None:
+            self.buckets.touch(hash_)
+            return self._resolved(cached)
+        return self._start_search(hash_)
+
+    def _start_search(self, hash_, find_value=False):
+        # A lookup counts as activity for the bucket it falls in.
+        self.buckets.touch(hash_)
         # Get closest contacts.
         contacts = self.buckets.get_closest(hash_)
         # Init the search.
-        self.shortlists.start_search(hash_, contacts)
+        future = self.shortlists.start_search(hash_, contacts, find_value)
+        future.add_done_callback(
+            lambda f: self._cache_result(hash_, f))
+        return future
+
+    def _resolved(self, result):
+        future = Future()
+        future.set_result(result)
+        return future
+
+    def _cache_result(self, hash_, future):
+        if future.cancelled():
+            return
+        result = future.result()
+        # Nothing worth remembering if the search came up empty
+        if result.found is not None or len(result.closest) > 0:
+            self.cache.put(hash_, result)
+
+    def find_node(self, hash_):
+        """
+        Awaitable version of :func:`init_search` for asyncio code.
+        Must be called with an event loop running.
+
+        :param hash_: Hash to attempt to find.
+        :type hash_: :class:`~common.Hash`
+        :returns: An awaitable for the result of the search.
+        :rtype: :class:`asyncio.Future`
+            (:attr:`~kademlia.shortlist.SearchResult`)
+        """
+        return asyncio.wrap_future(self.init_search(hash_))
 
-    def send_search(self, hash_, contact):
+    def find_value(self, hash_):
         """
-        Sends a find node message out to a contact.
+        Searches the DHT for a stored value.
+        The search stops at the first contact that returns one.
 
-        :param hash_: Hash to search for.
+        :param hash_: The key of the value.
         :type hash_: :class:`~common.Hash`
+        :returns: A future for the result of the search.
+        :rtype: :class:`concurrent.futures.Future`
+            (:attr:`~kademlia.shortlist.SearchResult`)
+        """
+        value = self.records.get(hash_)
+        if value is not None:
+            return self._resolved(SearchResult(None, [], value))
+        cached = self.cache.get(hash_)
+        if cached is not None and cached.value is not None:
+            return self._resolved(cached)
+        return self._start_search(hash_, find_value=True)
+
+    def store(self, hash_, value, ttl=RECORD_TTL):
+        """
+        Publishes a value to the K closest contacts to its key.
+        The value is kept (and republished) locally as well.
+
+        :param hash_: The key of the value.
+        :type hash_: :class:`~common.Hash`
+        :param value: The value.
+        :type value: bytes
+        :param ttl: Seconds the value should live for.
+        :type ttl: int.
+        :returns: A future for the search for the closest contacts.
+        :rtype: :class:`concurrent.futures.Future`
+        :raises ValueError: If the value is larger than
+            :attr:`~kademlia.store.MAX_VALUE_SIZE`, as no node would
+            hold it.
+        """
+        if len(value) > MAX_VALUE_SIZE:
+            raise ValueError("Values are at most %d bytes" % MAX_VALUE_SIZE)
+        self.records.put(hash_, value, ttl, original=True)
+        data = {'hash': hash_, 'value': value, 'ttl': ttl}
+
+        def send_stores(future):
+            if future.cancelled():
+                return
+            for contact in future.result().closest:
+                self.net.send_data(contact, 'dht.store', dict(data))
+        future = self._start_search(hash_)
+        future.add_done_callback(send_stores)
+        return future
+
+    def send_search(self, hashes, contact, find_value=False):
+        """
+        Sends a find node (or find value) message out to a contact.
+        Several hashes go out as one batched node search,
+        which :class:`~kademlia.shortlist.Shortlists` only asks for
+        when the contact's protocol version knows it.
+
+        :param hashes: Hashes to search for.
+        :type hashes: [:class:`~common.Hash`]
         :param contact: The contact to send the request to.
         :type contact: :class:`~common.Contact`
+        :param find_value: Ask for a stored value instead.
+            Only one hash may be given then.
+        :type find_value: bool.
         """
-        data = {'hash': hash_}
-        self.net.send_data(contact, 'dht.search', data)
+        if len(hashes) > 1:
+            self.net.send_data(contact, 'dht.search.batch',
+                               {'hashes': hashes})
+            return
+        data = {'hash': hashes[0]}
+        msg_name = 'dht.find_value' if find_value else 'dht.search'
+        self.net.send_data(contact, msg_name, data)
 
     def end_search(self, hash_, contact):
         """
         Event proc'd on the end of a search.
+        Results are handed out through the futures of the searches,
+        this only logs them.
         """
-        print("Found Contact:", contact, hash_.base64)
+        Logger.debug("Search for %s ended with %s" % (hash_, contact))
@@ -0,0 +1,110 @@
+from datetime import timedelta
+from threading import Lock
+import random
+
+from common import btlxlogger as logger
+from common.clock import REAL
+from .bucket import CHECK_MIN, REFRESH_MIN
+
+Logger = logger.get(__name__)
+
+MAX_REFRESHES = 2
+"""Most refresh lookups that may be in flight at once."""
+REFRESH_TIMEOUT = 60
+"""Seconds before an unfinished refresh stops counting against the cap."""
+STARTUP_JITTER = 30
+"""Upper bound (seconds) on the random delay before the first sweep."""
+
+
+class Refresher():
+    """
+    Keeps idle parts of the routing table warm.
+
+    Every :attr:`~kademlia.bucket.CHECK_MIN` minutes the buckets
+    that have had no activity for :attr:`~kademlia.bucket.REFRESH_MIN`
+    are looked up with a random hash from their range, stalest first.
+    At most :attr:`max_refreshes` lookups run at once, so a large
+    table going stale together does not flood the network.
+
+    .. attribute:: max_refreshes
+
+        Cap on concurrent refresh lookups.
+    .. attribute:: _in_flight
+
+        Targets of running refreshes and their start times.
+        {:class:`~common.Hash`: :class:`datetime.datetime`}
+    """
+
+    def __init__(self, buckets, search, max_refreshes=MAX_REFRESHES,
+                 clock=REAL):
+        """
+        :param buckets: The routing table to refresh.
+        :type buckets: :class:`~kademlia.bucket.Buckets`
+        :param search: Function to start a lookup for a hash.
+            Must return a future for the lookup.
+        :type search: :func:`~kademlia.Kademlia.init_search`
+        :param max_refreshes: Cap on concurrent refresh lookups.
+        :type max_refreshes: int.
+        :param clock: Source of time and of the loop sweeps run on.
+        :type clock: :class:`~common.Clock`
+        """
+        self._buckets = buckets
+        self._search = search
+        self.max_refreshes = max_refreshes
+        self._in_flight = {}
+        self._lock = Lock()
+        self._clock = clock
+        self._loop = clock.loop()
+        # Stagger the first sweep so nodes started together spread out
+        self._loop.call_later(random.uniform(0, STARTUP_JITTER),
+                              self._watcher)
+
+    def on_search_done(self, hash_, *args):
+        """
+        Called when a refresh lookup finishes.
+        Frees up its slot.
+
+        :param hash_: The target of the finished lookup.
+        :type hash_: :class:`~common.Hash`
+        """
+        with self._lock:
+            self._in_flight.pop(hash_, None)
+
+    def refresh(self):
+        """
+        Starts lookups for the stalest buckets, up to the cap.
+
+        :returns: The targets that lookups were started for.
+        :rtype: [:class:`~common.Hash`]
+        """
+        now = self._clock.now()
+        # Our own contact alone is not worth searching from
+        if len(self._buckets) <= 1:
+            return []
+        with self._lock:
+            timeout = now - timedelta(seconds=REFRESH_TIMEOUT)
+            self._in_flight = {h: t for h, t in self._in_flight.items()
+                               if t > timeout}
+            free = self.max_refreshes - len(self._in_flight)
+            if free <= 0:
+                return []
+            stale = self._buckets.stale(now - timedelta(minutes=REFRESH_MIN))
+            targets = [self._buckets.random_hash(i) for i in stale[:free]]
+            for target in targets:
+                self._in_flight[target] = now
+        for target in targets:
+            Logger.debug("Refreshing bucket of %s" % target)
+            future = self._search(target)
+            future.add_done_callback(
+                lambda f, target=target: self.on_search_done(target))
+        return targets
+
+    def _watcher(self):
+        """
+        Sweeps for stale buckets and schedules the next sweep.
+        """
+        self._loop.call_later(CHECK_MIN * 60, self._watcher)
+        try:
+            self.refresh()
+        except Exception:
+            Logger.exception("Bucket refresh failed")
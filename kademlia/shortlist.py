@@ -1,9 +1,13 @@
 #!/usr/bin/python3
 from collections import namedtuple
+from heapq import heappush, heappop, heapify
+from itertools import count
 
 from common import Contact, Address, Hash, Event
+from common.clock import REAL
 from common import List as list
 from common import btlxlogger as logger
+from .bucket import proximity_key
 from .exceptions import NoContactsError
 
 Logger = logger.get(__name__)
@@ -20,10 +24,23 @@ class SearchContact():
     .. attribute:: contact
 
         The contact
+    .. attribute:: distance
+
+        The :class:`~common.hash.Distance` of contact ^ target
+    .. attribute:: responded
+
+         If the contact answered our request
+    .. attribute:: hop
+
+         Round trips it took to learn of the contact
+         (1 for the contacts the search started with)
     """
-    def __init__(self, contacted, contact):
+    def __init__(self, contacted, contact, distance=None, hop=1):
         self.contacted = contacted
         self.contact = contact
+        self.distance = distance
+        self.responded = False
+        self.hop = hop
 
     def __str__(self):
         return "<%s: %s>" % (self.contacted, self.contact)
@@ -62,14 +79,27 @@ class ClosestContact():
 #: asynchronous operation in progress.
 InProgress = namedtuple('InProgress', ['contact', 'time'])
 
+#: The outcome of a search.
+#: found is the target contact (or None),
+#: closest are the contacts that answered, nearest first,
+#: value is the stored value for value searches (or None),
+#: hops are the round trips on the path to the result,
+#: rpcs are the requests the search sent.
+SearchResult = namedtuple('SearchResult', ['found', 'closest', 'value',
+                                           'hops', 'rpcs'])
+SearchResult.__new__.__defaults__ = (0, 0)
+
 
 class Shortlist():
     """
     Used when searching for a hash on the DHT.
 
-    .. attribute:: search_space
+    Entries are indexed by hash, and the uncontacted ones are kept
+    in two heaps keyed on distance to the target
+    (nearest first and farthest first).
+    Heap items are invalidated lazily: anything that was contacted
+    or replaced is skipped when it reaches the top.
 
-        A list of the :class:`kademlia.SearchContact`.
     .. attribute:: closest
 
         The closest hash found so far.
@@ -79,45 +109,104 @@ class Shortlist():
     .. attribute:: target_hash
 
         The hash that this shortlist is searching for.
+    .. attribute:: searched
+
+        Number of contacts the shortlist has searched.
+    .. attribute:: find_value
+
+        If this search asks for a stored value
+        and ends as soon as one is returned.
+    .. attribute:: value
+
+        The value that was found, if any.
     .. attribute:: in_progress
 
-        List of :attr:`~kademlia.shortlist.InProgress` contacts
-        that the shortlist is awaiting a response from.
+        :attr:`~kademlia.shortlist.InProgress` contacts that
+        the shortlist is awaiting a response from.
+        {(ip, port): :attr:`~kademlia.shortlist.InProgress`}
+    .. attribute:: alpha
+
+        How many requests this search may have in flight.
+        Set by :class:`~kademlia.shortlist.Shortlists`.
     .. attribute:: on_full_or_found
 
         Fired when all closer contacts are exausted or the contact is found.
     """
 
-    def __init__(self, own_hash, target_hash, initial_contacts, K):
+    def __init__(self, own_hash, target_hash, initial_contacts, K,
+                 find_value=False, clock=REAL, proximity=False):
         """
         :param target_hash: The :hash that this shortlist is seaching for.
         :type target_hash: :class:`common.Hash`
         :param initial_contacts: Contacts to start the shorlist with.
         :type initial_contacts: [:class:`common.Contact`]
+        :param find_value: If this is a search for a stored value.
+        :type find_value: bool.
+        :param clock: Time source for the in progress stamps.
+        :type clock: :class:`~common.Clock`
+        :param proximity: Query contacts in
+            :func:`~kademlia.bucket.proximity_key` order.
+        :type proximity: bool.
         """
         self.K = K
-        self.search_space = list(SearchContact(contacted=False, contact=x)
-                                 for x in initial_contacts)
+        self._clock = clock
+        self._proximity = proximity
+        self.find_value = find_value
+        self.value = None
         self.own_hash = own_hash
         self.target_hash = target_hash
         self.on_full_or_found = Event('Shortlist.on_full_or_found')
-        self.in_progress = []
-        # Ensure we start off increasing.
-        self.sort()
+        self.in_progress = {}
+        self.alpha = None
+        self.searched = 0
+        self._entries = {}  # {hash: SearchContact}
+        self._nearest = []  # [(distance or proximity key, seq, SC)]
+        self._farthest = []  # [(-distance, seq, SearchContact)]
+        self._seq = count()
         self._closest = {}
+        self._found_hop = None
+        for contact in initial_contacts:
+            self._try_add(contact)
         # Add the closest contact (our vote)
         # This only matters if there is 2 nodes
-        c = self.find_min()
-        if c is not None:
+        if len(self._entries) > 0:
+            c = min(self._entries.values(), key=lambda x: x.distance)
             self._add_closest(c.contact)
 
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def search_space(self):
+        """
+        :returns: All :class:`kademlia.shortlist.SearchContact`,
+            sorted by distance.
+        :rtype: [:class:`kademlia.shortlist.SearchContact`]
+        """
+        return list(sorted(self._entries.values(), key=lambda x: x.distance))
+
+    @property
+    def responded(self):
+        """
+        :returns: The contacts that answered, nearest first.
+        :rtype: [:class:`common.Contact`]
+        """
+        return list(x.contact for x in self.search_space if x.responded)
+
     @property
-    def searched(self):
+    def hops(self):
         """
-        :returns: Number of clients the shortlist has searched.
+        :returns: Round trips on the path to the result:
+            the hop of the contact that returned the target (or value),
+            otherwise that of the nearest contact that answered.
         :rtype: int.
         """
-        return self.search_space.count(lambda x: x.contacted)
+        if self._found_hop is not None:
+            return self._found_hop
+        for entry in self.search_space:
+            if entry.responded:
+                return entry.hop
+        return 0
 
     @property
     def closest(self):
@@ -131,19 +220,19 @@ class Shortlist():
             contact.address.tuple, ClosestContact(contact, distance))
         self._closest[contact.address.tuple].increment()
 
-    def update(self, new_contacts):
+    def update(self, new_contacts, hop=0):
         """
         Update the existing list with new contacts.
 
         :param new_contacts: Contacts returned by a search() operation.
         :type new_contacts: [:class:`common.Contact`]
+        :param hop: Hop of the contact that returned them.
+        :type hop: int.
         """
-        # Sort incoming contacts
-        new_contacts.sort(key=lambda x: x.hash ^ self.target_hash)
-
         # Do some upvoting
         if len(new_contacts) > 0:
-            self._add_closest(new_contacts[0])
+            self._add_closest(min(new_contacts,
+                                  key=lambda x: x.hash ^ self.target_hash))
 
         # Add the contacts
         for contact in new_contacts:
@@ -151,47 +240,87 @@ class Shortlist():
             if (self.own_hash != contact.hash):
                 # Stop if the desired contact is found
                 if (contact.hash == self.target_hash):
+                    self._found_hop = hop
                     self.on_full_or_found(self.target_hash, contact)
                 else:
-                    self._try_add(contact)
+                    self._try_add(contact, hop + 1)
+
+    def set_value(self, value, hop=0):
+        """
+        Ends a value search with the value that was found.
+
+        :param value: The value returned by a contact.
+        :type value: bytes
+        :param hop: Hop of the contact that returned it.
+        :type hop: int.
+        """
+        self.value = value
+        self._found_hop = hop
+        self.on_full_or_found(self.target_hash, self.closest)
 
     def rm_search(self, addr):
         """
-        Filters all searches to remove the one given to it.
+        Removes the in progress search for an address
+        and notes that it answered.
 
         :param addr: The address to remove.
         :type addr: :class:`common.Address`
+        :returns: The hop of the contact that answered
+            (0 if it was no longer awaited).
+        :rtype: int.
         """
-        self.in_progress = list(filter(lambda x: x.contact.address != addr,
-                                       self.in_progress))
-
-    def _try_add(self, contact):
+        item = self.in_progress.pop(addr.tuple, None)
+        if item is not None:
+            entry = self._entries.get(item.contact.hash)
+            if entry is not None:
+                entry.responded = True
+                return entry.hop
+        return 0
+
+    def _is_live(self, item):
+        entry = item[2]
+        return (not entry.contacted and
+                self._entries.get(entry.contact.hash) is entry)
+
+    def _push(self, entry):
+        seq = next(self._seq)
+        if self._proximity:
+            rank = proximity_key(entry.contact, entry.distance)
+        else:
+            rank = entry.distance
+        heappush(self._nearest, (rank, seq, entry))
+        heappush(self._farthest, (-entry.distance, seq, entry))
+        # Keep dead heap items from piling up on long searches
+        if len(self._farthest) > 4 * self.K:
+            self._nearest = [x for x in self._nearest if self._is_live(x)]
+            self._farthest = [x for x in self._farthest if self._is_live(x)]
+            heapify(self._nearest)
+            heapify(self._farthest)
+
+    def _try_add(self, contact, hop=1):
         """
         Tries to add a contact to a shortlist.
-
-        The algorithmic complexity of this function is a tad high.
-        Not terribly pertinent with K=20 though.
+        If the shortlist is full, the contact replaces the
+        farthest uncontacted one if it is closer.
 
         :param contact: The contact to add.
         :type contact: :class:`common.Contact`
+        :param hop: Round trips it took to learn of the contact.
+        :type hop: int.
         """
         # Check that the hash does not already exist.
-        if not self.search_space.any(lambda x: x.contact.hash == contact.hash):
-            # if < K contacts, add to the list.
-            if (len(self.search_space) < self.K):
-                self.search_space.append(SearchContact(False, contact))
-            # if == K contacts, and < K contacted.
-            elif (self.searched < self.K):
-                # Set the max to the min so it must increment.
-                max = self.find_min()
-                if (contact.hash ^ self.target_hash <
-                        max.contact.hash ^ self.target_hash):
-                    self.search_space.remove(max)
-                    self.search_space.append(SearchContact(False, contact))
-                    self.sort()
-
-    def sort(self):
-        self.search_space.sort(key=lambda x: x.contact.hash ^ self.target_hash)
+        if contact.hash in self._entries:
+            return
+        distance = contact.hash ^ self.target_hash
+        # if == K contacts, replace the farthest uncontacted one.
+        if len(self._entries) >= self.K:
+            farthest = self.find_max()
+            if farthest is None or distance >= farthest.distance:
+                return
+            del(self._entries[farthest.contact.hash])
+        entry = SearchContact(False, contact, distance, hop)
+        self._entries[contact.hash] = entry
+        self._push(entry)
 
     def get_next(self):
         """
@@ -199,74 +328,39 @@ class Shortlist():
         Also marks as contacted.
         """
         # We are below the count and have at least one useable contact still.
-        if ((self.searched <= self.K) and
-                (self.search_space.any(lambda x: not x.contacted))):
-            item = self.find_min()
-            item.contacted = True
-            self.in_progress.append(InProgress(item.contact,
-                                               datetime.now()))
-            return item.contact
-        else:
+        if self.searched >= self.K:
             return None
-
-    def find_min(self, uncontacted=True):
+        item = self.find_min()
+        if item is None:
+            return None
+        heappop(self._nearest)
+        item.contacted = True
+        self.searched += 1
+        self.in_progress[item.contact.address.tuple] = InProgress(
+            item.contact, self._clock.now())
+        return item.contact
+
+    def _peek(self, heap):
+        while len(heap) > 0:
+            if self._is_live(heap[0]):
+                return heap[0][2]
+            heappop(heap)
+        return None
+
+    def find_min(self):
         """
-        Returns the minimum item from the shortlist.
-
-        .. todo:: Clean this up.
+        :returns: The closest uncontacted item from the shortlist
+            (in proximity mode, the cheapest of the closest ones).
+        :rtype: :class:`kademlia.shortlist.SearchContact` or None
         """
-        searchLambda = lambda x: not x.contacted
-        # Find first uncontacted contact
-        if (uncontacted):
-            if (self.searched >= self.K):
-                self.on_full_or_found(self.target_hash, self.closest)
-                return None
-        else:
-            searchLambda = None
-        try:
-            minCon = self.search_space.first(searchLambda)
-        except ValueError:
-            return None
+        return self._peek(self._nearest)
 
-        for contact in self.search_space:
-            if (uncontacted and not contact.contacted):
-                if (contact.contact.hash ^ self.target_hash <
-                        minCon.contact.hash ^ self.target_hash):
-                    minCon = contact
-            elif (not uncontacted):
-                if (contact.contact.hash ^ self.target_hash <
-                        minCon.contact.hash ^ self.target_hash):
-                    minCon = contact
-        return minCon
-
-    def find_max(self, uncontacted=True):
+    def find_max(self):
         """
-        Returns the maximum item from the shortlist.
-
-        .. todo::
-
-            Clean this up.
+        :returns: The farthest uncontacted item from the shortlist.
+        :rtype: :class:`kademlia.shortlist.SearchContact` or None
         """
-        searchLambda = lambda x: not x.contacted
-        # Find first uncontacted contact
-        if (uncontacted):
-            if (self.searched > self.K):
-                return None
-        else:
-            searchLambda = None
-        maxCon = self.search_space.first(searchLambda)
-
-        # Reversed because we should ALWAYS be increasing.
-        for contact in reversed(self.search_space):
-            if (uncontacted and not contact.contacted):
-                if (contact.contact.hash ^ self.target_hash >
-                        maxCon.contact.hash ^ self.target_hash):
-                    maxCon = contact
-            elif (not uncontacted):
-                if (contact.contact.hash ^ self.target_hash >
-                        maxCon.contact.hash ^ self.target_hash):
-                    maxCon = contact
-        return maxCon
+        return self._peek(self._farthest)
 
     def __str__(self):
         return '%s : %s - P:%d F:%d T:%d' % (self.target_hash,
@@ -275,10 +369,28 @@ class Shortlist():
                                              self.searched,
                                              self.K)
 
-from threading import Thread
-from datetime import datetime
+from collections import deque
+from concurrent.futures import Future
 from time import sleep
-from queue import Queue
+
+#: Multiple of a contact's ping before a search RPC is considered lost.
+TIMEOUT_MULT = 5
+#: Percentile of recent RTTs after which a request is hedged.
+HEDGE_PCT = 90
+#: Amount of recent response RTTs kept for the hedge percentile.
+RTT_SAMPLES = 64
+#: Samples needed before the percentile is trusted over contact pings.
+MIN_RTT_SAMPLES = 8
+#: Multiple of A that a search's parallelism may grow to.
+MAX_ALPHA_MULT = 2
+#: Seconds node search RPCs to a contact that is already being searched
+#: through are held to go out together.
+BATCH_WINDOW = 0.005
+#: Most targets sent to a contact in one batched search.
+BATCH_MAX = 4
+#: First protocol version that knows batched searches.
+#: Contacts on an older one are always sent single searches.
+BATCH_VERSION = 2
 
 
 class Shortlists():
@@ -286,44 +398,105 @@ class Shortlists():
     Interface class for multiple
     :class:`~kademlia.shortlist.Shortlist`.
 
+    All shortlist work happens on one loop from the clock.
+    Each task (new search, response, RPC deadline) runs as soon as it is
+    posted or due, so a lookup hop costs one round trip
+    instead of a polling interval.
+
+    Parallelism adapts per search, between A and
+    :attr:`~kademlia.shortlist.MAX_ALPHA_MULT` times A.
+    A request still unanswered past the
+    :attr:`~kademlia.shortlist.HEDGE_PCT` percentile of recent RTTs
+    raises it by one, which sends a hedged request to the next contact
+    while the slow one stays outstanding.
+    Each response that beats that percentile lowers it by one again.
+
+    Searches for a hash that is already being searched for
+    share the running shortlist instead of starting another one.
+
+    A node search RPC goes out right away, unless another search is
+    already waiting on the same contact. Then it is held for
+    :attr:`~kademlia.shortlist.BATCH_WINDOW` and goes out as one
+    request for up to :attr:`~kademlia.shortlist.BATCH_MAX` targets,
+    so a lone search never waits on the window.
+    Value searches, and any search to a contact whose
+    :attr:`~common.Contact.proto_version` is below
+    :attr:`~kademlia.shortlist.BATCH_VERSION`, are always sent on their own.
+
     .. attribute:: on_search
 
         Event for when a search message should be sent.
-        (:class:`~common.Hash`, :class:`~common.Contact`)
+        ([:class:`~common.Hash`], :class:`~common.Contact`, bool find_value)
     .. attribute:: on_full_or_found
 
         Event for when the list is either full or found the contact.
         Returns either the contact or the closest one found.
     """
 
-    def __init__(self, own_hash, K, A):
+    def __init__(self, own_hash, K, A, clock=REAL, proximity=False):
+        """
+        :param clock: Source of time and of the loop to run on.
+        :type clock: :class:`~common.Clock`
+        :param proximity: Query cheap contacts first among
+            ones at similar distance.
+        :type proximity: bool.
+        """
+        self.proximity = proximity
         self.K = K
         self.A = A
         self._own_hash = own_hash
         self._shortlists = {}  # {hash : shortlist}
-        self._task_queue = Queue()
+        self._waiters = {}  # {hash : [Future]}
+        self._rtts = deque(maxlen=RTT_SAMPLES)
+        self._hedge_after = None
+        self._batches = {}  # {(ip, port) : (Contact, [Hash])}
+        self._clock = clock
+        self._loop = clock.loop()
         self.on_search = Event('Shortlists.on_search')
         self.on_full_or_found = Event('Shortlists.on_full_or_found')
-        self._watcher_thread = Thread(target=self._watcher)
-        self._watcher_thread.daemon = True
-        self._watcher_thread.start()
 
-    def start_search(self, hash_, contacts):
+    def start_search(self, hash_, contacts, find_value=False):
         """
         Adds a task to begin a search for a hash.
+        Joins the running search if there already is one for the hash,
+        turning it into a value search if needed.
+
+        .. note::
+
+            Callbacks added to the future run on the loop,
+            so they must not block.
 
         :param hash_: The hash to search for.
         :type hash_: :class:`~common.Hash`
         :param contacts: The initial contacts.
         :type contacts: [:class:`~common.Contact`]
+        :param find_value: Ask for a stored value and stop on the first one.
+        :type find_value: bool.
+        :returns: A future for the result of the search.
+        :rtype: :class:`concurrent.futures.Future`
+            (:attr:`~kademlia.shortlist.SearchResult`)
         """
         Logger.debug("Starting Search: %s", hash_)
-        self._task_queue.put((self._start_search, (hash_, contacts)))
-
-    def _start_search(self, hash_, contacts):
-        self._shortlists[hash_] = Shortlist(self._own_hash, hash_, contacts, self.K)
-        self._shortlists[hash_].on_full_or_found += self.on_full_or_found
-        self._shortlists[hash_].on_full_or_found += self.rm_list
+        future = Future()
+        self._loop.post(self._start_search, hash_, contacts, future,
+                        find_value)
+        return future
+
+    def _start_search(self, hash_, contacts, future, find_value):
+        if hash_ in self._shortlists:
+            Logger.debug("Joining running search: %s", hash_)
+            self._waiters[hash_].append(future)
+            if find_value:
+                self._shortlists[hash_].find_value = True
+            return
+        self._waiters[hash_] = [future]
+        shortlist = Shortlist(self._own_hash, hash_, contacts, self.K,
+                              find_value, self._clock, self.proximity)
+        shortlist.alpha = self.A
+        self._shortlists[hash_] = shortlist
+        shortlist.on_full_or_found += self._on_done
+        shortlist.on_full_or_found += self.on_full_or_found
+        self._pump(hash_, shortlist)
 
     def add_response(self, hash_, request_addr, responses):
         """
@@ -337,12 +510,39 @@ class Shortlists():
         :type responses: [:class:`common.Contact`]
         """
         Logger.debug("Add Response: %s", request_addr)
-        self._task_queue.put((self._add_response, (hash_, request_addr,
-                                                   responses)))
+        self._loop.post(self._add_response, hash_, request_addr, responses)
 
     def _add_response(self, hash_, request_addr, responses):
-        self._shortlists[hash_].rm_search(request_addr)
-        self._shortlists[hash_].update(responses)
+        shortlist = self._shortlists.get(hash_)
+        # Late answer to a search that already ended
+        if shortlist is None:
+            return
+        self._on_answer(shortlist, request_addr)
+        hop = shortlist.rm_search(request_addr)
+        shortlist.update(responses, hop)
+        self._pump(hash_, shortlist)
+
+    def add_value(self, hash_, request_addr, value):
+        """
+        Adds a task to end a value search with a found value.
+
+        :param hash_: The hash identifier for the target.
+        :type hash_: :class:`common.Hash`
+        :param request_addr: The responding address.
+        :type request_addr: :class:`common.Address`
+        :param value: The value received.
+        :type value: bytes
+        """
+        Logger.debug("Add Value: %s", request_addr)
+        self._loop.post(self._add_value, hash_, request_addr, value)
+
+    def _add_value(self, hash_, request_addr, value):
+        shortlist = self._shortlists.get(hash_)
+        if shortlist is None:
+            return
+        self._on_answer(shortlist, request_addr)
+        hop = shortlist.rm_search(request_addr)
+        shortlist.set_value(value, hop)
 
     def rm_list(self, hash_, *args):
         """
@@ -351,51 +551,149 @@ class Shortlists():
         :param hash_: The hash identifier for the target.
         :type hash_: :class:`common.Hash`
         """
-        self._task_queue.put((self._rm_list, (hash_, )))
+        self._loop.post(self._rm_list, hash_)
 
     def _rm_list(self, hash_):
         # This should NOT cause a mem leak
         # since it has the pointers to functions.
-        del(self._shortlists[hash_])
-
-    def _clean_lists(self):
-        for hash_, shortlist in self._shortlists.items():
-            # Magic Number [1000]: convert seconds to ms
-            # Magic Number [5]: tweakable to set how long to timeout requests
-            alive = list(filter(lambda x: (datetime.now()-x.time).total_seconds() * 1000
-                                           < x.contact.ping * 5,
-                                shortlist.in_progress))
-            # If any of the requests have timed out.
-            if (len(alive) != len(shortlist.in_progress)):
-                shortlist.in_progress = alive
-            # Add any needed more requests to reach the parallel param A.
-            while (len(shortlist.in_progress) < self.A):
-                next_min = shortlist.get_next()
-                # We have no more useable responses.
-                if (next_min is None):
-                    # No searches are in progress.
-                    if (len(shortlist.in_progress) == 0):
-                        shortlist.on_full_or_found(shortlist.target_hash,
-                                                   shortlist.closest)
-                    break
-                else:
-                    self.on_search(hash_, next_min)
+        self._shortlists.pop(hash_, None)
+        for future in self._waiters.pop(hash_, []):
+            future.cancel()
+
+    def _on_done(self, hash_, contact):
+        # Always fired from the loop, so drop it right away
+        # to stop any more RPCs going out for it.
+        shortlist = self._shortlists.pop(hash_, None)
+        if shortlist is None:
+            return
+        found = contact if (contact is not None and
+                            contact.hash == hash_) else None
+        result = SearchResult(found, shortlist.responded, shortlist.value,
+                              shortlist.hops, shortlist.searched)
+        for future in self._waiters.pop(hash_, []):
+            # Skips any that the caller cancelled
+            if future.set_running_or_notify_cancel():
+                future.set_result(result)
+
+    def _on_answer(self, shortlist, request_addr):
+        """
+        Records the RTT of an answer and lowers the parallelism
+        of its search if it came back quickly.
+        """
+        item = shortlist.in_progress.get(request_addr.tuple)
+        if item is None:
+            return
+        rtt = (self._clock.now() - item.time).total_seconds()
+        if rtt < self._hedge_delay(item.contact):
+            shortlist.alpha = max(self.A, shortlist.alpha - 1)
+        self._rtts.append(rtt)
+        if len(self._rtts) >= MIN_RTT_SAMPLES:
+            rtts = sorted(self._rtts)
+            self._hedge_after = rtts[len(rtts) * HEDGE_PCT // 100]
+
+    def _hedge_delay(self, contact):
+        """
+        :returns: Seconds before a request to a contact is hedged.
+        :rtype: float
+        """
+        if self._hedge_after is not None:
+            return self._hedge_after
+        # Magic Number [1000]: convert ms to seconds
+        return contact.ping / 1000
 
-    def _watcher(self):
+    def _hedge(self, hash_, addr, item):
+        """
+        Sends one more request for a search
+        if a request is still waiting past its hedge delay.
+        """
+        shortlist = self._shortlists.get(hash_)
+        if (shortlist is None or
+                shortlist.in_progress.get(addr) is not item):
+            return
+        if shortlist.alpha < self.A * MAX_ALPHA_MULT:
+            shortlist.alpha += 1
+            self._pump(hash_, shortlist)
+
+    def _pump(self, hash_, shortlist):
+        """
+        Sends requests until the search's parallelism is reached,
+        or ends the search if nothing is left to do.
+        """
+        while (self._shortlists.get(hash_) is shortlist and
+               len(shortlist.in_progress) < shortlist.alpha):
+            next_min = shortlist.get_next()
+            # We have no more useable responses.
+            if (next_min is None):
+                # No searches are in progress.
+                if (len(shortlist.in_progress) == 0):
+                    shortlist.on_full_or_found(shortlist.target_hash,
+                                               shortlist.closest)
+                break
+            addr = next_min.address.tuple
+            item = shortlist.in_progress[addr]
+            # Magic Number [1000]: convert ms to seconds
+            timeout = next_min.ping * TIMEOUT_MULT / 1000
+            self._loop.call_later(timeout, self._expire, hash_, addr, item)
+            hedge = self._hedge_delay(next_min)
+            if hedge < timeout:
+                self._loop.call_later(hedge, self._hedge, hash_, addr, item)
+            self._send(hash_, next_min, shortlist.find_value)
+
+    def _send(self, hash_, contact, find_value):
+        """
+        Sends a search RPC, or adds it to the batch for its contact.
+        A batch is only opened when another search
+        already has a request out to the contact,
+        and the contact speaks a version that knows batches.
         """
-        This function watches for any RPCs that must be made.
-        It is the only one that should modify the datavalues of the shorts.
+        if find_value or contact.proto_version < BATCH_VERSION:
+            self.on_search([hash_], contact, True)
+            return
+        addr = contact.address.tuple
+        batch = self._batches.get(addr)
+        if batch is None:
+            if not self._in_flight(hash_, addr):
+                self.on_search([hash_], contact, False)
+                return
+            batch = (contact, [hash_])
+            self._batches[addr] = batch
+            self._loop.call_later(BATCH_WINDOW, self._flush, addr, batch)
+        else:
+            batch[1].append(hash_)
+        if len(batch[1]) >= BATCH_MAX:
+            self._flush(addr, batch)
+
+    def _in_flight(self, hash_, addr):
+        """
+        :returns: If a search other than the one for `hash_`
+            is waiting on an answer from the address.
+        :rtype: bool.
+        """
+        return any(addr in shortlist.in_progress
+                   for h, shortlist in self._shortlists.items()
+                   if h != hash_)
 
-        .. note:: This call is blocking, so run it threaded.
+    def _flush(self, addr, batch):
+        """
+        Sends out a batch of search RPCs, unless it already went.
+        """
+        if self._batches.get(addr) is not batch:
+            return
+        del(self._batches[addr])
+        contact, hashes = batch
+        self.on_search(hashes, contact, False)
+
+    def _expire(self, hash_, addr, item):
+        """
+        Drops a request whose deadline has passed
+        and refills the search it belonged to.
         """
-        while (True):
-            while (self._task_queue.qsize() > 0):
-                task = self._task_queue.get()
-                if (task[0] != self._clean_lists):
-                    Logger.debug('TASK: %s', str(task))
-                task[0](*(task[1]))
-            sleep(0.5)
-            self._task_queue.put((self._clean_lists, ()))
+        shortlist = self._shortlists.get(hash_)
+        # Skip anything that was answered or ended meanwhile
+        if (shortlist is not None and
+                shortlist.in_progress.get(addr) is item):
+            del(shortlist.in_progress[addr])
+            self._pump(hash_, shortlist)
 
 
 # Placeholder for when a search is triggered.
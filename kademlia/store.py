@@ -0,0 +1,259 @@
+from heapq import heappush, heappop, heapify
+from itertools import count
+from threading import Lock
+
+from common import btlxlogger as logger
+from common.clock import REAL
+
+Logger = logger.get(__name__)
+
+RECORD_TTL = 24 * 60 * 60
+"""Seconds a record lives unless it is republished. Also the max accepted."""
+REPUBLISH_SEC = 60 * 60
+"""Seconds between republishes of the records we published."""
+REPUBLISH_CHECK_SEC = 60
+"""Seconds between expiry / republish sweeps."""
+REPUBLISH_BATCH = 10
+"""Most records republished in one sweep."""
+MAX_RECORDS = 4096
+"""
+Most records held at once.
+When full, a new record from another node pushes out the stored one
+that expires soonest; our own records are never pushed out.
+"""
+MAX_VALUE_SIZE = 1024
+"""Largest value accepted, in bytes, so a ``dht.value`` fits one datagram."""
+
+
+class Record():
+    """
+    Simple struct for a stored value.
+
+    .. attribute:: key
+
+        The :class:`~common.Hash` the value is stored under.
+    .. attribute:: value
+
+        The raw bytes value.
+    .. attribute:: ttl
+
+        Seconds the record was stored for.
+    .. attribute:: expires
+
+        Clock (:func:`~common.Clock.monotonic`) time
+        that the record expires at.
+    .. attribute:: original
+
+        If this node published the record (and so republishes it).
+    """
+    def __init__(self, key, value, ttl, original, now):
+        self.key = key
+        self.value = value
+        self.ttl = ttl
+        self.expires = now + ttl
+        self.original = original
+
+    def __str__(self):
+        return "<%s: %d bytes>" % (self.key, len(self.value))
+
+
+class RecordStore():
+    """
+    Local store of DHT records.
+
+    Records are indexed by key for lookups, and by expiry time
+    (and republish time for our own records) in heaps,
+    so a sweep only touches the records that are actually due.
+    Heap items for replaced records are skipped lazily,
+    and dropped once they outnumber the live records.
+
+    Other nodes choose what is stored here, so values are capped at
+    :attr:`~kademlia.store.MAX_VALUE_SIZE` bytes and the store at
+    :attr:`~kademlia.store.MAX_RECORDS` records.
+    """
+
+    def __init__(self, clock=REAL, max_records=MAX_RECORDS):
+        """
+        :param clock: Time source for expiry and republishing.
+        :type clock: :class:`~common.Clock`
+        :param max_records: Most records to hold.
+        :type max_records: int.
+        """
+        self.max_records = max_records
+        self._clock = clock
+        self._records = {}  # {key: Record}
+        self._expiry = []  # [(expires, seq, Record)]
+        self._republish = []  # [(due, seq, Record)]
+        self._seq = count()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._records)
+
+    def _is_live(self, record):
+        return self._records.get(record.key) is record
+
+    def put(self, key, value, ttl=RECORD_TTL, original=False):
+        """
+        Stores or replaces a record.
+
+        :param key: The key to store under.
+        :type key: :class:`~common.Hash`
+        :param value: The value.
+        :type value: bytes
+        :param ttl: Seconds to keep it for. Capped at
+            :attr:`~kademlia.store.RECORD_TTL`.
+        :type ttl: int.
+        :param original: If this node published it.
+        :type original: bool.
+        :returns: If the record was stored.
+            Values over :attr:`~kademlia.store.MAX_VALUE_SIZE` are not,
+            nor records from other nodes when the store is full
+            of our own.
+        :rtype: bool.
+        """
+        if len(value) > MAX_VALUE_SIZE:
+            return False
+        ttl = min(ttl, RECORD_TTL)
+        now = self._clock.monotonic()
+        with self._lock:
+            old = self._records.get(key)
+            if (old is None and len(self._records) >= self.max_records
+                    and not self._evict(now) and not original):
+                return False
+            # Never let a remote store downgrade one of our own records
+            original = original or (old is not None and old.original)
+            record = Record(key, value, ttl, original, now)
+            self._records[key] = record
+            heappush(self._expiry, (record.expires, next(self._seq), record))
+            if original:
+                heappush(self._republish, (now + REPUBLISH_SEC,
+                                           next(self._seq), record))
+            if len(self._expiry) > 2 * len(self._records):
+                self._expiry = [x for x in self._expiry
+                                if self._is_live(x[2])]
+                heapify(self._expiry)
+        return True
+
+    def _evict(self, now):
+        """
+        Makes room for one record, with the lock held.
+        Drops an expired record if there is one,
+        otherwise the record from another node that expires soonest.
+
+        :returns: If a record was dropped.
+        :rtype: bool.
+        """
+        kept = []
+        evicted = False
+        while len(self._expiry) > 0:
+            item = heappop(self._expiry)
+            record = item[2]
+            if not self._is_live(record):
+                continue
+            if record.original and record.expires > now:
+                kept.append(item)
+                continue
+            del(self._records[record.key])
+            evicted = True
+            break
+        for item in kept:
+            heappush(self._expiry, item)
+        return evicted
+
+    def get(self, key):
+        """
+        :param key: The key to look up.
+        :type key: :class:`~common.Hash`
+        :returns: The value, or None if it is not held or has expired.
+        :rtype: bytes
+        """
+        with self._lock:
+            record = self._records.get(key)
+            if (record is None or
+                    record.expires <= self._clock.monotonic()):
+                return None
+            return record.value
+
+    def expire(self):
+        """
+        Drops every record that has expired.
+
+        :returns: Amount of records dropped.
+        :rtype: int.
+        """
+        now = self._clock.monotonic()
+        dropped = 0
+        with self._lock:
+            while len(self._expiry) > 0 and self._expiry[0][0] <= now:
+                record = heappop(self._expiry)[2]
+                if self._is_live(record):
+                    del(self._records[record.key])
+                    dropped += 1
+        return dropped
+
+    def due(self, limit=REPUBLISH_BATCH):
+        """
+        Pops our own records that are due for a republish.
+
+        :param limit: Most records to return.
+        :type limit: int.
+        :rtype: [:class:`~kademlia.store.Record`]
+        """
+        now = self._clock.monotonic()
+        records = []
+        with self._lock:
+            while (len(records) < limit and len(self._republish) > 0
+                   and self._republish[0][0] <= now):
+                record = heappop(self._republish)[2]
+                if self._is_live(record):
+                    records.append(record)
+        return records
+
+
+class Republisher():
+    """
+    Sweeps the :class:`~kademlia.store.RecordStore`.
+    Drops expired records and republishes a batch of our own
+    records each sweep, so they are spread out over time.
+    """
+
+    def __init__(self, store, publish, clock=REAL):
+        """
+        :param store: The local records.
+        :type store: :class:`~kademlia.store.RecordStore`
+        :param publish: Function to (re)publish a value.
+        :type publish: :func:`~kademlia.Kademlia.store`
+        :param clock: Source of the loop the sweeps run on.
+        :type clock: :class:`~common.Clock`
+        """
+        self._store = store
+        self._publish = publish
+        self._loop = clock.loop()
+        self._loop.call_later(REPUBLISH_CHECK_SEC, self._watcher)
+
+    def sweep(self):
+        """
+        Runs one expiry and republish pass.
+
+        :returns: The records that were republished.
+        :rtype: [:class:`~kademlia.store.Record`]
+        """
+        dropped = self._store.expire()
+        if dropped > 0:
+            Logger.debug("Expired %d records" % dropped)
+        records = self._store.due()
+        for record in records:
+            Logger.debug("Republishing %s" % record)
+            self._publish(record.key, record.value, record.ttl)
+        return records
+
+    def _watcher(self):
+        """
+        Runs a sweep on the loop and schedules the next one.
+        """
+        self._loop.call_later(REPUBLISH_CHECK_SEC, self._watcher)
+        try:
+            self.sweep()
+        except Exception:
+            Logger.exception("Record sweep failed")
@@ -1,10 +1,14 @@
+from functools import partial
+
 from .tagconstants import Tags
+from .common import PROTO_VERSION
 from .contacttable import ContactTable
 from .prototree import Protocol
 from .udp import Server
 from net import protofuncs
 from common import SentPacket
 from common.packetwatcher import PacketWatcher
+from common.clock import REAL
 from common.exceptions import ChannelDNEError
 import common.btlxlogger as logger
 
@@ -16,13 +20,30 @@ class Stack():
     Main accessor to the bytelynx networking stack.
     Translates all data to expected values, as well
     as houses the on_data events for parsed packets.
+
+    .. attribute:: own_hash
+
+        This node's :class:`~common.Hash`, sent in hellos.
     """
 
-    def __init__(self, port, dh_group):
-        self._server = Server(port)
-        self._contacts = ContactTable(dh_group)
+    def __init__(self, port, dh_group, own_hash, server=None, clock=REAL):
+        """
+        :param port: UDP port to listen on.
+        :type port: int.
+        :param dh_group: The 'p' parameter for the group.
+        :param own_hash: This node's hash.
+        :type own_hash: :class:`~common.Hash`
+        :param server: Datagram transport to use instead of a
+            :class:`~net.udp.Server` bound to `port`.
+        :param clock: Source of time and loops for the stack.
+        :type clock: :class:`~common.Clock`
+        """
+        self.own_hash = own_hash
+        self._clock = clock
+        self._server = server if server is not None else Server(port)
+        self._contacts = ContactTable(dh_group, self, clock)
         self.protocol = Protocol(self._contacts.translate)
-        self.watcher = PacketWatcher()
+        self.watcher = PacketWatcher(clock)
         self.watcher.on_resend += self.resend
 
         # make packet watcher
@@ -31,9 +52,9 @@ class Stack():
 
     def _handle_btlx(self):
         msgs = self.protocol.messages
-        msgs['hello'].on_data += protofuncs.on_hello
-        msgs['dh.g'].on_data += protofuncs.on_dh_g
-        msgs['dh.mix'].on_data += protofuncs.on_dh_B
+        msgs['hello'].on_data += partial(protofuncs.on_hello, self)
+        msgs['dh.g'].on_data += partial(protofuncs.on_dh_g, self)
+        msgs['dh.mix'].on_data += partial(protofuncs.on_dh_B, self)
 
     def update_contacts(self, contacts):
         return self._contacts.update(contacts)
@@ -89,6 +110,17 @@ class Stack():
         self._server.send(pkt.contact.address, pkt.data)
         self.watcher.add_packet(pkt)
 
+    def send_hello(self, contact):
+        """
+        Introduces this node to a contact,
+        offering the newest protocol version it speaks.
+
+        :param contact: The contact to say hello to.
+        :type contact: :class:`~common.contact`
+        """
+        self.send_data(contact, 'hello', {'hash': self.own_hash,
+                                          Tags.version.value: PROTO_VERSION})
+
     def send_data(self, contact, msg_name, data):
         """
         Sends packet to a given contact.
@@ -110,10 +142,7 @@ class Stack():
             if msg.mode == 'aes-dht':
                 Logger.info("Establishing AES-DHT channel with %s" % contact.address)
                 contact.add_sent_msg(msg.mode, msg_name, data)
-                # Send a 'Hello'
-                import state
-                s = state.get()
-                self.send_data(contact, 'hello', {'hash': s.contact.hash})
+                self.send_hello(contact)
             else:
                 raise e
         else:
@@ -121,13 +150,14 @@ class Stack():
             data[Tags.pktid.value] = pkt_id
 
             # Encode data
-            payload = msg.encode(contact, data)
+            payload = self.protocol.encode(msg_name, contact, data)
 
             # Send data to a contact
             self._server.send(contact.address, payload)
 
             # Check if this message is sent 'reliably'
             if msg.is_pongable:
-                pkt = SentPacket(pkt_id, payload, contact, channel)
+                pkt = SentPacket(pkt_id, payload, contact, channel,
+                                 self._clock)
                 channel.packets[pkt_id] = pkt
                 self.watcher.add_packet(pkt)
@@ -0,0 +1,288 @@
+import struct
+
+from .tag import Encoded, SIZE
+from .tagconstants import Tags
+from .common import (MAGIC_HEADER, PROTO_VERSION, PROTO_VERSIONS,
+                     BASE_VERSION, TYPE_SYMBOL, VERSION_SYMBOL,
+                     VERSION_SHIFT, TYPE_MASK,
+                     pack_varint, unpack_varint)
+from common.exceptions import ProtocolError, ChannelDNEError
+import common.btlxlogger as logger
+
+Logger = logger.get(__name__)
+
+#: Type byte of every message below the carrier
+TYPE = struct.Struct(TYPE_SYMBOL)
+#: Version byte after the magic string (version 1)
+VERSION = struct.Struct(VERSION_SYMBOL)
+
+
+def carrier_header(version, pkt_type):
+    """
+    :param version: Protocol version of the packet.
+    :type version: int.
+    :param pkt_type: Type of the carrier's submessage.
+    :type pkt_type: int.
+    :returns: The magic string, version and type
+        that a packet of this type starts with.
+    :rtype: bytes
+    """
+    if version == BASE_VERSION:
+        return MAGIC_HEADER + VERSION.pack(version) + TYPE.pack(pkt_type)
+    if pkt_type > TYPE_MASK:
+        raise ValueError("Type %s does not fit next to the version"
+                         % pkt_type)
+    return MAGIC_HEADER + TYPE.pack((version << VERSION_SHIFT) | pkt_type)
+
+
+def read_header(data):
+    """
+    Reads what :func:`carrier_header` wrote.
+    The magic string is not checked.
+
+    :param data: The datagram.
+    :type data: bytes-like
+    :returns: The version, the type of the carrier's submessage
+        and the offset after them.
+    :rtype: (int, int, int)
+    """
+    offset = len(MAGIC_HEADER)
+    packed = data[offset]
+    if packed == BASE_VERSION:
+        offset += VERSION.size
+        return BASE_VERSION, TYPE.unpack_from(data, offset)[0], \
+            offset + TYPE.size
+    return packed >> VERSION_SHIFT, packed & TYPE_MASK, offset + TYPE.size
+
+
+class MessageCodec():
+    """
+    Flat encoder for one leaf message of the protocol tree.
+
+    The chain of messages from the carrier down to the leaf is
+    worked out once, so encoding does not walk up the parents.
+    The magic string, version and the type bytes that come before
+    the first tag (or the first encrypted layer) are one
+    precomputed header.
+    A codec writes one protocol version: sizes are 2 bytes each
+    in version 1 and LEB128 varints from version 2 on.
+
+    The header, size prefixes and tag values of a packet are gathered
+    as separate pieces and joined once, so the packet is allocated
+    at its final size and every piece is copied into it exactly once.
+    An encrypted section is joined into a buffer of its own
+    and its ciphertext is one more piece of the section around it.
+
+    .. attribute:: msg_name
+
+        Name of the leaf message.
+    .. attribute:: version
+
+        Protocol version that is written.
+    .. attribute:: header
+
+        The constant bytes every packet of this message starts with.
+    """
+
+    def __init__(self, message, version=PROTO_VERSION):
+        """
+        :param message: The leaf message.
+        :type message: :class:`~net.prototree.Message`
+        :param version: Protocol version to write.
+        :type version: int.
+        """
+        from .prototree import Encrypted
+        self.msg_name = message.msg_name
+        self.version = version
+        self._pack_size = (SIZE.pack if version == BASE_VERSION
+                           else pack_varint)
+        chain = []
+        while message.parent is not None:
+            chain.insert(0, message)
+            message = message.parent
+        # [(type bytes, [(tag name, tag)], encrypted mode or None)]
+        levels = [(TYPE.pack(x.index),
+                   [(tag.name, tag.for_version(version)) for tag in x.tags],
+                   x.mode if isinstance(x, Encrypted) else None)
+                  for x in chain]
+        # The carrier's type byte always goes into the header
+        self.header = carrier_header(version, chain[0].index)
+        levels[0] = (b'',) + levels[0][1:]
+        # [([(bytes before, tag name, tag)],
+        #   type bytes of the encrypted level after these, its mode)]
+        # Outermost first, each one is encrypted inside the one before.
+        self._segments = []
+        parts = []
+        for prefix, tags, mode in levels:
+            if mode is not None:
+                self._segments.append((parts, prefix, mode))
+                parts = []
+                prefix = b''
+            if len(tags) == 0:
+                parts.append((prefix, None, None))
+                continue
+            parts.append((prefix,) + tags[0])
+            parts.extend((b'',) + tag for tag in tags[1:])
+        self._segments.append((parts, b'', None))
+        # The constant bytes in front of the first tag are in every packet
+        parts, prefix, mode = self._segments[0]
+        while len(parts) > 0 and parts[0][1] is None:
+            self.header += parts.pop(0)[0]
+        if len(parts) == 0:
+            self.header += prefix
+            self._segments[0] = (parts, b'', mode)
+        # Constant bytes between tags are only kept where there are any
+        self._segments = [([(before or None, name, tag)
+                            for before, name, tag in parts], prefix, mode)
+                          for parts, prefix, mode in self._segments]
+
+    def _collect(self, index, out, contact, data):
+        parts, prefix, mode = self._segments[index]
+        append = out.append
+        pack_size = self._pack_size
+        for before, name, tag in parts:
+            if before is not None:
+                append(before)
+            if name is not None:
+                value = data[name]
+                d = value if isinstance(value, Encoded) else tag.pack(value)
+                append(pack_size(len(d)))
+                append(d)
+        if mode is not None:
+            inner = []
+            self._collect(index + 1, inner, contact, data)
+            append(prefix)
+            append(contact.channels[mode].crypto.encrypt(b''.join(inner)))
+
+    def encode(self, contact, data):
+        """
+        :param contact: Contact that this message is going to.
+        :type contact: :class:`common.Contact`
+        :param data: Data to encode, the tags of all levels.
+        :type data: dict.
+        :returns: The datagram.
+        :rtype: bytes
+        """
+        out = [self.header]
+        self._collect(0, out, contact, data)
+        return b''.join(out)
+
+
+class NodeDecoder():
+    """
+    Compiled decoder for one message of the protocol tree
+    and, through its children, for everything below it.
+
+    Optional tags missing from the end of a message are left out of
+    the data; a packet that is cut short anywhere else
+    is a :class:`~common.exceptions.ProtocolError`.
+    """
+
+    def __init__(self, message, version=BASE_VERSION):
+        """
+        :param message: The message.
+        :type message: :class:`~net.prototree.Message`
+        :param version: Protocol version to read.
+        :type version: int.
+        """
+        from .prototree import Encrypted
+        self.msg_name = message.msg_name
+        self._varint = version != BASE_VERSION
+        self._mode = message.mode if isinstance(message, Encrypted) else None
+        self._tags = [(tag.name, tag.for_version(version).unpack,
+                       tag.optional)
+                      for tag in message.tags]
+        self._children = {idx: NodeDecoder(x, version)
+                          for idx, x in message.submessages.items()}
+
+    def decode(self, data, contact, offset=0):
+        """
+        Nothing is copied on the way down:
+        every layer reads from the same view at its own offset,
+        and tags get views of their values.
+
+        :param data: Data to decode.
+        :type data: :class:`memoryview`
+        :param contact: Contact that this message came from.
+        :type contact: :class:`common.Contact`
+        :param offset: Where this message starts in the data.
+        :type offset: int.
+        :returns: msg_name, data
+        """
+        if self._mode is not None:
+            try:
+                crypto = contact.channels[self._mode].crypto
+            except KeyError:
+                raise ChannelDNEError(self._mode)
+            data = memoryview(crypto.decrypt(data[offset:]))
+            offset = 0
+        msg_name = self.msg_name
+        ret_data = {}
+        for name, decode, optional in self._tags:
+            if offset == len(data) and optional:
+                break
+            try:
+                if self._varint:
+                    size, offset = unpack_varint(data, offset)
+                else:
+                    size = SIZE.unpack_from(data, offset)[0]
+                    offset += SIZE.size
+            except (IndexError, struct.error):
+                raise ProtocolError("%s is cut short" % msg_name)
+            if offset + size > len(data):
+                raise ProtocolError("%s is cut short" % msg_name)
+            ret_data[name] = decode(data[offset:offset + size])
+            offset += size
+        if len(self._children) > 0:
+            if offset >= len(data):
+                raise ProtocolError("%s is cut short" % msg_name)
+            pkt_type = TYPE.unpack_from(data, offset)[0]
+            msg_name, ret_data[Tags.payload.value] = \
+                self._child(pkt_type, data, offset + TYPE.size, contact)
+            ret_data[Tags.type.value] = pkt_type
+        return msg_name, ret_data
+
+    def _child(self, pkt_type, data, offset, contact):
+        try:
+            child = self._children[pkt_type]
+        except KeyError:
+            raise ProtocolError("Unknown message type %s" % pkt_type)
+        return child.decode(data, contact, offset)
+
+
+class CarrierDecoder():
+    """
+    Compiled decoder for the root of the protocol tree.
+    Checks the header and hands off to the message below,
+    through the decoders of the packet's protocol version.
+    """
+
+    def __init__(self, message):
+        """
+        :param message: The carrier message.
+        :type message: :class:`~net.prototree.CarrierMessage`
+        """
+        self._versions = {version: NodeDecoder(message, version)
+                          for version in PROTO_VERSIONS}
+
+    def decode(self, data, contact):
+        """
+        :param data: The datagram.
+        :type data: bytes-like
+        :param contact: Contact that this message came from.
+        :type contact: :class:`common.Contact`
+        :returns: msg_name, data
+        """
+        data = memoryview(data)
+        if data[:len(MAGIC_HEADER)] != MAGIC_HEADER:
+            raise ProtocolError("Magic string does not match")
+        version, pkt_type, offset = read_header(data)
+        try:
+            decoder = self._versions[version]
+        except KeyError:
+            Logger.error("Protocol version mismatch (%s vs known %s)" %
+                         (version, PROTO_VERSIONS))
+            raise ProtocolError("Protocol is from a different version")
+        msg_name, r_dict = decoder._child(pkt_type, data, offset, contact)
+        r_dict[Tags.type.value] = pkt_type
+        return msg_name, r_dict
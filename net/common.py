@@ -1,15 +1,80 @@
 #: First bytes to identify bytelynx traffic.
 MAGIC_HEADER = b'btlx'
-#: Current protocol version. Just a placeholder for later.
-PROTO_VERSION = 1
+#: Newest protocol version spoken, offered to every contact in hello.
+PROTO_VERSION = 2
+#: Protocol version every node speaks.
+#: Used with a contact until its hello says otherwise.
+BASE_VERSION = 1
+#: All protocol versions that can be encoded and decoded.
+PROTO_VERSIONS = (1, 2)
 
 
 # Struct constants.
 #: The symbol for struct.[un]pack's endianess
 ENDIAN = '>'
-#: The tag preceeding every value for the size of it in bytes
+#: The tag preceeding every value for the size of it in bytes (version 1)
 SIZE_SYMBOL = ENDIAN + 'H'
-#: The protocol version tag
+#: The protocol version tag (version 1)
 VERSION_SYMBOL = ENDIAN + 'B'
 #: The type of message
 TYPE_SYMBOL = ENDIAN + 'B'
+
+# Version 2 and up.
+# The byte after the magic string holds the version in its high bits
+# and the type of the carrier's submessage in its low bits.
+# In version 1 that byte is the version alone (0x01), so it tells
+# the two layouts apart.
+#: Bits to shift the version by in the packed type byte
+VERSION_SHIFT = 4
+#: Mask of the message type in the packed type byte
+TYPE_MASK = (1 << VERSION_SHIFT) - 1
+
+#: The single byte LEB128 varints, so small sizes are not packed each time
+_SMALL_VARINTS = tuple(bytes((x,)) for x in range(0x80))
+
+
+def pack_varint(value):
+    """
+    Encodes an unsigned integer as a LEB128 varint:
+    7 bits per byte, least significant first,
+    with the high bit set on every byte but the last.
+    Sizes of version 2 packets are written this way,
+    so values below 128 bytes only take one byte for their size.
+
+    :param value: The integer.
+    :type value: int.
+    :rtype: bytes
+    """
+    if value < 0x80:
+        return _SMALL_VARINTS[value]
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def unpack_varint(data, offset=0):
+    """
+    Decodes a LEB128 varint.
+
+    :param data: Data the varint is in.
+    :type data: bytes-like
+    :param offset: Where the varint starts.
+    :type offset: int.
+    :returns: The integer and the offset after it.
+    :rtype: (int, int)
+    """
+    byte = data[offset]
+    if byte < 0x80:
+        return byte, offset + 1
+    value = byte & 0x7f
+    shift = 7
+    while True:
+        offset += 1
+        byte = data[offset]
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset + 1
+        shift += 7
@@ -1,8 +1,9 @@
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 from common import List as list
 from common import Contact
 from common import Property
+from common.clock import REAL
 
 #: Time (in minutes) before a contact is removed.
 EXPIRE_TIME = 10
@@ -19,19 +20,25 @@ class ContactTable(Property):
 
     _flatten_dicts = ['_contacts_by_addr', '_friends']
 
-    def __init__(self, dh_group):
+    def __init__(self, dh_group, net=None, clock=REAL):
         """
         :param dh_group: The 'p' parameter for the group.
+        :param net: The stack that contacts in this table send through.
+        :type net: :class:`~net.Stack`
+        :param clock: Time source for last seen stamps and sweeps.
+        :type clock: :class:`~common.Clock`
         """
         # Super weird init
         # Using self as the value so the serialization
         # is called on this base object
         super().__init__('contact_table', self)
         self._dh_p = dh_group
+        self._net = net
+        self._clock = clock
         self._contacts_by_addr = {}
         self._contacts_by_hash = {}
         self._friends = {}
-        self._last_check = datetime.now()
+        self._last_check = clock.now()
 
     def __str__(self):
         """
@@ -70,7 +77,8 @@ class ContactTable(Property):
                         rcontact.hash = contact.hash
                 # Happens if the contact is not made
                 except KeyError:
-                    contact.channels['bytelynx'].crypto.p = self._dh_p
+                    contact.set_dh_group(self._dh_p)
+                    contact.net = self._net
                     contact.on_hash += self.on_contact_hash
                     contact.on_death += self.clean_contact
                     self._contacts_by_addr[str(contact.address)] = contact
@@ -120,7 +128,7 @@ class ContactTable(Property):
         try:
             contact = self._contacts_by_addr[str(address)]
             # Set the last time seen (to now)
-            contact.last_seen = datetime.now()
+            contact.last_seen = self._clock.now()
             # Try associating the contact with a friend
             if not contact.needs_hash and not contact.has_friend:
                 try:
@@ -130,7 +138,9 @@ class ContactTable(Property):
         # Errors if the contact does not exist
         except KeyError:
             contact = Contact(address)
-            contact.channels['bytelynx'].crypto.p = self._dh_p
+            contact.last_seen = self._clock.now()
+            contact.set_dh_group(self._dh_p)
+            contact.net = self._net
             contact.on_hash += self.on_contact_hash
             contact.on_death += self.clean_contact
             self._contacts_by_addr[str(address)] = contact
@@ -138,15 +148,15 @@ class ContactTable(Property):
 
         # Check for a sweep
         # TODO: Do we need to sweep contacts_by_hash?
-        if datetime.now() - self._last_check > \
-                timedelta(minutes=SWEEP_INTERVAL):
-            self._last_check = datetime.now()
-            del_time = datetime.now() - timedelta(minutes=EXPIRE_TIME)
+        now = self._clock.now()
+        if now - self._last_check > timedelta(minutes=SWEEP_INTERVAL):
+            self._last_check = now
+            del_time = now - timedelta(minutes=EXPIRE_TIME)
             del_list = list(self._contacts_by_addr.values())\
                 .where(lambda x: x.last_seen < del_time)
 
             for item in del_list:
-                item.on_death()
+                item.on_death(item)
         return contact
 
     def clean_contact(self, contact):
@@ -2,42 +2,52 @@
 from crypto.exceptions import StateError
 from crypto.aesgcm import KEY_SIZE
 from crypto import SHAModes
+from .common import PROTO_VERSION, PROTO_VERSIONS, BASE_VERSION
+from .tagconstants import Tags
 
 
-def on_hello(contact, data):
+def on_hello(net, contact, data):
     """
     Handler for client hellos.
-    Adds the client hash to the contact object.
+    Adds the client hash to the contact object,
+    and speaks the newest protocol version both sides know from now on.
+    Hellos from before versions were sent mean version 1,
+    as does any version that is not known here.
 
     If the hash already exists, initiates a DH exchange.
+
+    :param net: The stack the hello arrived on.
+    :type net: :class:`~net.Stack`
     """
-    import state
-    s = state.get()
+    version = max(BASE_VERSION,
+                  min(PROTO_VERSION,
+                      data.get(Tags.version.value, BASE_VERSION)))
+    if version not in PROTO_VERSIONS:
+        version = BASE_VERSION
+    contact.proto_version = version
     crypto = contact.channels['bytelynx'].crypto
     if contact.set_hash(data['hash']):
-        s.net.send_data(contact, 'hello', {'hash': s.contact.hash})
+        net.send_hello(contact)
     elif crypto.is_free:
-        s.net.send_data(contact, 'dh.g', {'dh_g': crypto.g})
+        net.send_data(contact, 'dh.g', {'dh_g': crypto.g})
 
 
-def on_dh_g(contact, data):
+def on_dh_g(net, contact, data):
     """
     Handler for Diffie-Hellman g params.
     Ensures the state is correct and mixes.
     """
-    import state
     crypto = contact.channels['bytelynx'].crypto
     crypto.g = data['dh_g']
-    state.get().net.send_data(contact, 'dh.mix', {'dh_B': crypto.A})
+    net.send_data(contact, 'dh.mix', {'dh_B': crypto.A})
 
 
-def on_dh_B(contact, data):
+def on_dh_B(net, contact, data):
     """
     Handler for the Diffie-Hellman B param.
     Ensures the state is correct and mixes.
     Creates the next level of crypto (aes-dht).
     """
-    import state
     dh_crypto = contact.channels['bytelynx'].crypto
 
     # Extract the key
@@ -53,11 +63,11 @@ def on_dh_B(contact, data):
 
     # Try to send our A, if needed
     try:
-        state.get().net.send_data(contact, 'dh.mix', {'dh_B': dh_crypto.A})
+        net.send_data(contact, 'dh.mix', {'dh_B': dh_crypto.A})
     # Happens if we have already sent an A
     # Send a DHT hello
     except StateError:
-        state.get().net.send_data(contact, 'dht.ping', {})
+        net.send_data(contact, 'dht.ping', {})
 
 
 def on_pubkey_request(contact, data):
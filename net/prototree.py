@@ -1,13 +1,9 @@
-import struct
-
 from net.tag import (Tag, HashTag, VarintTag,
-                     ListTag, NodeTag, StringTag,
+                     ListTag, NodeListTag, StringTag,
                      BytesTag)
-from net.common import (MAGIC_HEADER, PROTO_VERSION,
-                        TYPE_SYMBOL, SIZE_SYMBOL,
-                        VERSION_SYMBOL)
+from net.common import PROTO_VERSIONS
 from .tagconstants import Tags
-from common.exceptions import ProtocolError, ChannelDNEError
+from .codec import MessageCodec, CarrierDecoder
 from common import Event
 import common.btlxlogger as logger
 
@@ -18,7 +14,8 @@ class Message():
     """
     The base message.
     This is the most generic type that is used for basic protocols.
-    It also defines the interface for encoding and decoding.
+    Messages only describe the protocol: packets are encoded and
+    decoded by the codecs compiled from them (:mod:`net.codec`).
 
     .. note::
 
@@ -116,6 +113,14 @@ class Message():
     def __str__(self):
         return ("%s [%s]" % (self.msg_name, self.mode))
 
+    def get_tag(self, name):
+        """
+        :param name: Name of one of this message's tags.
+        :type name: str.
+        :rtype: :class:`~net.tag.Tag`
+        """
+        return next(tag for tag in self.tags if tag.name == name)
+
     def set_mode(self, mode):
         """
         Sets the protocol mode for a message and all children.
@@ -151,62 +156,6 @@ class Message():
         for idx, message in self.submessages.items():
             message.set_child_attrs(mode, idx, self)
 
-    def encode(self, contact, dict_data, bytes_data=b''):
-        """
-        :param contact: Contact that this message is going to.
-        :type contact: :class:`common.Contact`
-        :param dict_data: Data to encode.
-        :type dict_data: {}
-        :param bytes_data: Raw encoded data so far.
-        :type bytes_data: bytes
-        """
-        # Encode the msg type
-        # self.index should never == -1 (default)
-        # UNLESS this is the top level proto wrapper
-        # which overloads encode
-        data = struct.pack(TYPE_SYMBOL, self.index)
-        data += self._encode(dict_data)
-        return self.parent.encode(contact, dict_data, data + bytes_data)
-
-    def _encode(self, dict_data):
-        data = b''
-        # Encode all tags for this level
-        if len(self.tags) > 0:
-            for tag in self.tags:
-                data += tag.to_encoded(dict_data[tag.name])
-        return data
-
-    def decode(self, data, contact):
-        """
-        :param data: Data to decode.
-        :type data: bytes
-        :param contact: Contact that this message is going to.
-        :type contact: :class:`common.Contact`
-        :returns: msg_name, data
-        """
-        msg_name = self.msg_name
-        ret_data = {}
-        offset = 0
-        if len(self.tags) > 0:
-            size_value_size = struct.calcsize(SIZE_SYMBOL)
-            for tag in self.tags:
-                size = struct.unpack(SIZE_SYMBOL,
-                                     data[offset:offset +
-                                          size_value_size])[0]
-                offset += size_value_size
-                ret_data[tag.name] = (tag.to_value(data[offset:offset + size]))
-                offset += size
-        if len(self.submessages) > 0:
-            # Figure out what type of packet this is.
-            pkt_type = struct.unpack(TYPE_SYMBOL,
-                                     data[offset:offset +
-                                          struct.calcsize(TYPE_SYMBOL)])[0]
-            offset += struct.calcsize(TYPE_SYMBOL)
-            ret_data[Tags.type.value] = pkt_type
-            msg_name, ret_data[Tags.payload.value] = self.submessages[pkt_type]\
-                .decode(data[offset:], contact)
-        return msg_name, ret_data
-
 
 class PongMessage(Message):
     """
@@ -225,45 +174,6 @@ class CarrierMessage(Message):
     Everything must be wrapped in this, as it is the root.
     """
 
-    def encode(self, contact, dict_data, bytes_data):
-        """
-        :param contact: Contact that this message is going to.
-        :type contact: :class:`common.Contact`
-        :param dict_data: Data to encode.
-        :type dict_data: {}
-        :param bytes_data: Raw encoded data so far.
-        :type bytes_data: bytes
-        """
-        header = (MAGIC_HEADER +
-                  struct.pack(VERSION_SYMBOL, PROTO_VERSION))
-        return header + bytes_data
-
-    def decode(self, data, contact):
-        offset = 0
-        # Check for magic string.
-        if data[:len(MAGIC_HEADER)] != MAGIC_HEADER:
-            raise ProtocolError("Magic string does not match")
-        offset += len(MAGIC_HEADER)
-        # Check for version number.
-        version = struct.unpack(VERSION_SYMBOL,
-                                data[offset:offset +
-                                     struct.calcsize(VERSION_SYMBOL)])[0]
-        if version != PROTO_VERSION:
-            Logger.error("Protocol version mismatch (%s vs known %s)" %
-                         (version, PROTO_VERSION))
-            raise ProtocolError("Protocol is from a different version")
-        offset += struct.calcsize(VERSION_SYMBOL)
-        # Figure out what type of packet this is.
-        pkt_type = struct.unpack(TYPE_SYMBOL,
-                                 data[offset:offset +
-                                      struct.calcsize(TYPE_SYMBOL)])[0]
-        offset += struct.calcsize(TYPE_SYMBOL)
-        # Get data out of it.
-        msg_name, r_dict = self.submessages[pkt_type].decode(data[offset:],
-                                                             contact)
-        r_dict[Tags.type.value] = pkt_type
-        return msg_name, r_dict
-
 
 class Encrypted(Message):
     """
@@ -280,26 +190,16 @@ class Encrypted(Message):
                          submessages=submessages, pong_msg=pong_msg,
                          is_pongable=is_pongable, mode=mode)
 
-    def encode(self, contact, dict_data, bytes_data):
-        data = struct.pack(TYPE_SYMBOL, self.index)
-        bytes_data = self._encode(dict_data) + bytes_data
-        data += contact.channels[self.mode]\
-            .crypto.encrypt(bytes_data)
-        return self.parent.encode(contact, dict_data, data)
-
-    def decode(self, data, contact):
-        try:
-            payload = contact.channels[self.mode]\
-                .crypto.decrypt(data)
-        except KeyError:
-            raise ChannelDNEError(self.mode)
-        else:
-            return super().decode(payload, contact)
-
 
 class Protocol():
     """
     Container for the ByteLynx protocol.
+
+    .. attribute:: codecs
+
+        The compiled encoder of every leaf message,
+        for each protocol version.
+        {int: {str.: :class:`~net.codec.MessageCodec`}}
     """
 
     def __init__(self, translator):
@@ -313,25 +213,31 @@ class Protocol():
 
     def decode(self, data, contact):
         """
-        Shortcut to decode using the local protocol.
+        Decodes a packet with the compiled decoders.
 
         :param data: Raw data to decode.
         :type data: bytes
         :param contact: The contact that the message belongs to.
         :type contact: :class:`~common.Contact`
+        :returns: msg_name, data
         """
-        return self.proto.decode(data, contact)
+        return self._decoder.decode(data, contact)
 
-    def encode(self, data, contact):
+    def encode(self, msg_name, contact, data):
         """
-        Shortcut to encode using the local protocol.
+        Encodes a packet with the compiled encoder of a message,
+        in the protocol version spoken with the contact.
 
-        :param data: Data to encode.
-        :type data: dict
+        :param msg_name: The unique name of the message.
+        :type msg_name: str.
         :param contact: The contact that the message belongs to.
         :type contact: :class:`~common.Contact`
+        :param data: Data to encode.
+        :type data: dict
+        :rtype: bytes
         """
-        return self.proto.encode(data, contact)
+        return self.codecs[contact.proto_version][msg_name]\
+            .encode(contact, data)
 
     def get_messages(self, proto=None):
         """
@@ -370,7 +276,10 @@ class Protocol():
             mode='bytelynx',
             submessages={
                 # TODO: The whole outer layer should be HMAC'd
-                0: Message('hello', tags=[HashTag()]),
+                # The version is the newest one the sender speaks
+                0: Message('hello', tags=[HashTag(),
+                                          Tag(Tags.version.value, 'B',
+                                              optional=True)]),
                 1: Message('dh.g', tags=[VarintTag('dh_g')]),
                 2: Message('dh.mix', tags=[VarintTag('dh_B')]),
                 # DHT AES-encrypted messages.
@@ -388,8 +297,7 @@ class Protocol():
                     # DHT Response
                     4: Message('dht.response', is_pongable=True,
                                tags=[HashTag(),
-                                     ListTag('nodes',
-                                             NodeTag(translator))],
+                                     NodeListTag('nodes', translator)],
                                dht_func=self.on_dht),
                     # Public key share
                     5: Message('rsa.pubkey.request', is_pongable=True,
@@ -400,7 +308,31 @@ class Protocol():
                     7: Encrypted('rsa-ex', is_pongable=True, submessages={
                         1: Message('rsa.ex',
                                    tags=[BytesTag('iv')])
-                        })
+                        }),
+                    # DHT value store
+                    8: Message('dht.store', is_pongable=True,
+                               tags=[HashTag(), BytesTag('value'),
+                                     VarintTag('ttl')],
+                               dht_func=self.on_dht),
+                    # DHT value search, answered with
+                    # dht.value if held or dht.response if not
+                    9: Message('dht.find_value', is_pongable=True,
+                               tags=[HashTag()],
+                               dht_func=self.on_dht),
+                    10: Message('dht.value', is_pongable=True,
+                                tags=[HashTag(), BytesTag('value')],
+                                dht_func=self.on_dht),
+                    # DHT Search for several targets at once
+                    11: Message('dht.search.batch', is_pongable=True,
+                                tags=[ListTag('hashes', HashTag())],
+                                dht_func=self.on_dht),
+                    # DHT Response, one node list per target
+                    12: Message('dht.response.batch', is_pongable=True,
+                                tags=[ListTag('hashes', HashTag()),
+                                      ListTag('results',
+                                              NodeListTag('nodes',
+                                                          translator))],
+                                dht_func=self.on_dht)
                     }),
                 # Net AES-encrypted messages.
                 # Key comes from PKI in AES-DHT layer.
@@ -416,3 +348,8 @@ class Protocol():
             }
         )
         # end-before
+        self.codecs = {version: {name: MessageCodec(msg, version)
+                                 for name, msg
+                                 in self.get_messages(self.proto).items()}
+                       for version in PROTO_VERSIONS}
+        self._decoder = CarrierDecoder(self.proto)
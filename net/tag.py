@@ -1,53 +1,124 @@
 import struct
+from socket import AF_INET, AF_INET6, inet_pton, inet_ntop
 
 from common import Hash, Address
-from .common import ENDIAN, SIZE_SYMBOL
+from common.exceptions import ProtocolError
+from .common import (ENDIAN, SIZE_SYMBOL, BASE_VERSION,
+                     pack_varint, unpack_varint)
+
+#: Size prefix of every tag value
+SIZE = struct.Struct(SIZE_SYMBOL)
+#: Hash width, IPv4 count and IPv6 count in front of a node list
+NODES_HEADER = struct.Struct(ENDIAN + 'BHH')
+#: Port at the end of every node record
+PORT = struct.Struct(ENDIAN + 'H')
+#: Packed address length of each family
+IP_SIZES = {AF_INET: 4, AF_INET6: 16}
+
+
+class Encoded(bytes):
+    """
+    Bytes that already are the encoding of a tag's value
+    (without the size in front).
+    Given to a tag in place of the value, they are sent as they are.
+    Used to send answers that were encoded earlier.
+    """
+
+
+class NodeRecord(Encoded):
+    """
+    :class:`Encoded` fixed-width record of one node,
+    as made by :func:`NodeListTag.record`.
+
+    .. attribute:: family
+
+        Address family of the record (:data:`socket.AF_INET` or
+        :data:`socket.AF_INET6`).
+    """
+
+    def __new__(cls, data, family):
+        self = super().__new__(cls, data)
+        self.family = family
+        return self
 
 
 class Tag():
     """
-    Construct to transform a data value to encoded data and back.
-    Stores one packed value of a given type.
+    Stateless codec between a data value and its encoded data.
+    Packs one value of a given type.
+    Encoded data may be given as any bytes-like object,
+    such as a :class:`memoryview` of a received packet.
+
+    A tag is shared by every packet of its message,
+    so it keeps nothing from one call to the next:
+    :func:`pack` and :func:`unpack` only depend on their argument,
+    and any thread may use a tag at any time.
+
+    .. attribute:: optional
+
+        If the tag may be missing from the end of its message,
+        so messages can gain tags without breaking older peers.
+        Optional tags must come after all others.
 
     .. TODO: Maybe reverse this with BytesTag as the base class
     """
 
-    def __init__(self, name, tag_struct):
+    def __init__(self, name, tag_struct, optional=False):
         self.name = name
+        self.optional = optional
         self.tag_struct = ENDIAN + tag_struct
-        self._value = None
-        self._header_size = struct.calcsize(SIZE_SYMBOL)
+        self._struct = struct.Struct(self.tag_struct)
 
-    @property
-    def encoded(self):
-        d = self._encoded
-        return struct.pack(SIZE_SYMBOL, len(d)) + d
+    def for_version(self, version):
+        """
+        Tags whose layout changed between protocol versions
+        give the tag that writes the older layout here.
 
-    @property
-    def _encoded(self):
-        return struct.pack(self.tag_struct, self._value)
+        :param version: Protocol version of the packet.
+        :type version: int.
+        :returns: The tag to use in that version.
+        :rtype: :class:`Tag`
+        """
+        return self
 
-    @encoded.setter
-    def encoded(self, value):
-        # Grab the first value.
-        # Since this is a simple setter, there should only ever be one.
-        self._value = struct.unpack(self.tag_struct, value)[0]
+    def pack(self, value):
+        """
+        Encodes a value, without the size in front.
 
-    def to_value(self, encoded):
-        self.encoded = encoded
-        return self.value
+        :param value: The value to encode.
+        :returns: The encoded value.
+        :rtype: bytes
+        """
+        return self._struct.pack(value)
 
-    def to_encoded(self, value):
-        self.value = value
-        return self.encoded
+    def unpack(self, data):
+        """
+        Decodes a value, without the size in front.
+
+        :param data: The encoded value.
+        :type data: bytes-like
+        :returns: The value.
+        """
+        # Grab the first value.
+        # Since this is a simple tag, there should only ever be one.
+        return self._struct.unpack(data)[0]
 
-    @property
-    def value(self):
-        return self._value
+    def to_encoded(self, value):
+        """
+        :param value: The value to encode, or its :class:`Encoded` bytes.
+        :returns: The encoded value with its size in front.
+        :rtype: bytes
+        """
+        d = value if isinstance(value, Encoded) else self.pack(value)
+        return SIZE.pack(len(d)) + d
 
-    @value.setter
-    def value(self, value):
-        self._value = value
+    def to_value(self, encoded):
+        """
+        :param encoded: The encoded value, without its size.
+        :type encoded: bytes-like
+        :returns: The value.
+        """
+        return self.unpack(encoded)
 
 
 class BoolTag(Tag):
@@ -70,17 +141,13 @@ class AddressTag(Tag):
     def __init__(self):
         super().__init__('address', '4BH')
 
-    @property
-    def _encoded(self):
-        return struct.pack(self.tag_struct,
-                           *([int(x) for x
-                              in self._value.ip.split('.')] +
-                             [self._value.port]))
+    def pack(self, value):
+        return self._struct.pack(*([int(x) for x in value.ip.split('.')] +
+                                   [value.port]))
 
-    @Tag.encoded.setter
-    def encoded(self, value):
-        raw = struct.unpack(self.tag_struct, value)
-        self._value = Address('.'.join(str(x) for x in raw[:4]), raw[4])
+    def unpack(self, data):
+        raw = self._struct.unpack(data)
+        return Address('.'.join(str(x) for x in raw[:4]), raw[4])
 
 
 class NodeTag(Tag):
@@ -94,19 +161,15 @@ class NodeTag(Tag):
         super().__init__('contact', '4BH')
         self.translator = translator
 
-    @property
-    def _encoded(self):
-        return self._value.hash.value + struct.pack(
-            self.tag_struct,
-           *([int(x) for x
-              in self._value.address.ip.split('.')] +
-             [self._value.address.port]))
-
-    @Tag.encoded.setter
-    def encoded(self, value):
-        end_size = struct.calcsize(self.tag_struct)
-        h = value[:-end_size]
-        raw = struct.unpack(self.tag_struct, value[-end_size:])
+    def pack(self, value):
+        return value.hash.value + self._struct.pack(
+            *([int(x) for x in value.address.ip.split('.')] +
+              [value.address.port]))
+
+    def unpack(self, data):
+        end_size = self._struct.size
+        h = bytes(data[:-end_size])
+        raw = self._struct.unpack(data[-end_size:])
         contact = self.translator(
             Address('.'.join(str(x) for x in raw[:4]), raw[4]))
         try:
@@ -114,38 +177,165 @@ class NodeTag(Tag):
         # Happens if the hash has already been set.
         except ValueError:
             pass
-        self._value = contact
+        return contact
 
 
 class ListTag(Tag):
     """
     Tag that encapsulates a list of single tag.
+    Elements are decoded from views of the encoded data,
+    so none of them are copied out first.
+
+    Every element has its size in front, 2 bytes in protocol
+    version 1 and a LEB128 varint from version 2 on,
+    the same as the sizes of tags (see :func:`for_version`).
+
+    .. attribute:: varint
+
+        If the element sizes are varints.
     """
 
-    def __init__(self, name, inner_tag):
+    def __init__(self, name, inner_tag, varint=False):
         """
         :param inner_tag: The tag inside the array.
         :type inner_tag: :class:`~net.tag.Tag` base
+        :param varint: Write the element sizes as varints.
+        :type varint: bool.
         """
         super().__init__(name, '')
         self.inner_tag = inner_tag
+        self.varint = varint
+        self._pack_size = pack_varint if varint else SIZE.pack
+        # {version: ListTag} of the layouts of other versions.
+        # Only ever filled with equal tags, so a race is harmless.
+        self._versions = {}
 
-    @property
-    def _encoded(self):
-        return b''.join(self.inner_tag.to_encoded(x) for x in self._value)
-
-    @Tag.encoded.setter
-    def encoded(self, in_bytes):
+    def for_version(self, version):
+        try:
+            return self._versions[version]
+        except KeyError:
+            pass
+        inner = self.inner_tag.for_version(version)
+        varint = version != BASE_VERSION
+        if inner is self.inner_tag and varint == self.varint:
+            tag = self
+        else:
+            tag = ListTag(self.name, inner, varint)
+        return self._versions.setdefault(version, tag)
+
+    def pack(self, value):
+        # One join for the whole list, sizes and elements side by side
+        parts = []
+        inner = self.inner_tag
+        pack_size = self._pack_size
+        for x in value:
+            d = x if isinstance(x, Encoded) else inner.pack(x)
+            parts.append(pack_size(len(d)))
+            parts.append(d)
+        return b''.join(parts)
+
+    def unpack(self, data):
+        data = memoryview(data)
+        unpack = self.inner_tag.unpack
         a = []
         x = 0
-        while x < len(in_bytes):
+        while x < len(data):
             # Grab the size.
-            sz = struct.unpack(SIZE_SYMBOL,
-                               in_bytes[x: x + self._header_size])[0]
-            x += self._header_size
-            a.append(self.inner_tag.to_value(in_bytes[x: x + sz]))
+            if self.varint:
+                sz, x = unpack_varint(data, x)
+            else:
+                sz = SIZE.unpack_from(data, x)[0]
+                x += SIZE.size
+            a.append(unpack(data[x: x + sz]))
             x += sz
-        self._value = a
+        return a
+
+
+class NodeListTag(Tag):
+    """
+    Tag that encapsulates a list of nodes
+    (:class:`common.Contact` objects with a hash).
+
+    Every node is a fixed-width record of its hash, packed address
+    and port, so unlike a :class:`ListTag` of :class:`NodeTag`
+    there is no size in front of each one.
+    A single header holds the hash width and the number of
+    IPv4 and IPv6 records; the records follow grouped by family,
+    and each group is decoded with one :func:`struct.iter_unpack`.
+    The order of nodes is only kept within a family.
+
+    Any element may be given as its :class:`NodeRecord`
+    from :func:`record`, which is sent as it is.
+
+    Version 1 of the protocol sends a :class:`ListTag` of
+    :class:`NodeTag` instead (see :func:`for_version`),
+    which only carries IPv4 nodes.
+    The record of an IPv4 node is exactly what :class:`NodeTag` packs,
+    so records can be given in either version.
+    """
+
+    def __init__(self, name, translator):
+        """
+        :param translator: The method to translate contacts.
+        :type translator: :attr:`~net.contacttable.translate`
+        """
+        super().__init__(name, '')
+        self.translator = translator
+        self._v1 = ListTag(name, NodeTag(translator))
+
+    def for_version(self, version):
+        return self._v1 if version == BASE_VERSION else self
+
+    def record(self, contact):
+        """
+        :param contact: The node.
+        :type contact: :class:`common.Contact`
+        :returns: The fixed-width record of the node.
+        :rtype: :class:`NodeRecord`
+        """
+        ip = contact.address.ip
+        family = AF_INET6 if ':' in ip else AF_INET
+        return NodeRecord(contact.hash.value + inet_pton(family, ip) +
+                          PORT.pack(contact.address.port), family)
+
+    def pack(self, value):
+        groups = {AF_INET: [], AF_INET6: []}
+        for x in value:
+            if x.__class__ is not NodeRecord:
+                x = self.record(x)
+            groups[x.family].append(x)
+        hash_size = 0
+        for family, records in groups.items():
+            if len(records) > 0:
+                hash_size = len(records[0]) - IP_SIZES[family] - PORT.size
+        v4, v6 = groups[AF_INET], groups[AF_INET6]
+        return b''.join([NODES_HEADER.pack(hash_size, len(v4), len(v6))] +
+                        v4 + v6)
+
+    def unpack(self, data):
+        data = memoryview(data)
+        hash_size, *counts = NODES_HEADER.unpack_from(data)
+        offset = NODES_HEADER.size
+        nodes = []
+        for family, count in zip((AF_INET, AF_INET6), counts):
+            end = offset + count * (hash_size + IP_SIZES[family] + PORT.size)
+            if end > len(data):
+                raise ProtocolError("Node list is cut short")
+            for h, ip, port in struct.iter_unpack(
+                    '%s%ds%dsH' % (ENDIAN, hash_size, IP_SIZES[family]),
+                    data[offset:end]):
+                contact = self.translator(Address(inet_ntop(family, ip),
+                                                  port))
+                try:
+                    contact.set_hash(Hash(h))
+                # Happens if the hash has already been set.
+                except ValueError:
+                    pass
+                nodes.append(contact)
+            offset = end
+        if offset != len(data):
+            raise ProtocolError("Node list has trailing bytes")
+        return nodes
 
 
 class BytesTag(Tag):
@@ -158,13 +348,12 @@ class BytesTag(Tag):
     def __init__(self, name):
         super().__init__(name, '')
 
-    @property
-    def _encoded(self):
-        return self._value
+    def pack(self, value):
+        return value
 
-    @Tag.encoded.setter
-    def encoded(self, value):
-        self._value = value
+    def unpack(self, data):
+        # Decoding may hand in a view of the packet
+        return bytes(data)
 
 
 class HashTag(BytesTag):
@@ -175,13 +364,11 @@ class HashTag(BytesTag):
     def __init__(self):
         super().__init__('hash')
 
-    @property
-    def _encoded(self):
-        return self._value.value
+    def pack(self, value):
+        return value.value
 
-    @Tag.encoded.setter
-    def encoded(self, value):
-        self._value = Hash(value)
+    def unpack(self, data):
+        return Hash(bytes(data))
 
 
 class StringTag(BytesTag):
@@ -189,13 +376,11 @@ class StringTag(BytesTag):
     Tag that encapsulates a variable-length string.
     """
 
-    @property
-    def _encoded(self):
-        return bytes(self._value, 'utf-8')
+    def pack(self, value):
+        return bytes(value, 'utf-8')
 
-    @Tag.encoded.setter
-    def encoded(self, value):
-        self._value = value.decode('utf-8')
+    def unpack(self, data):
+        return str(data, 'utf-8')
 
 
 class VarintTag(BytesTag):
@@ -206,11 +391,9 @@ class VarintTag(BytesTag):
     Will pad with null bits to reach a byte boundary.
     """
 
-    @property
-    def _encoded(self):
-        length = round((self._value.bit_length() / 8) + 0.5)
-        return self._value.to_bytes(length, 'big')
+    def pack(self, value):
+        length = round((value.bit_length() / 8) + 0.5)
+        return value.to_bytes(length, 'big')
 
-    @Tag.encoded.setter
-    def encoded(self, value):
-        self._value = int.from_bytes(value, 'big')
+    def unpack(self, data):
+        return int.from_bytes(data, 'big')
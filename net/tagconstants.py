@@ -5,3 +5,4 @@ class Tags(Enum):
     type = 'type'
     pktid = 'pkt_id'
     pongid = 'pong_id'
+    version = 'version'
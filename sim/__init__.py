@@ -0,0 +1,10 @@
+"""
+In-process simulation of a bytelynx network.
+
+Nodes run the real :class:`~net.Stack` and :class:`~kademlia.Kademlia`,
+but talk over an in-memory :class:`~sim.fabric.Fabric` and are driven
+by one :class:`~common.VirtualClock`, so thousands of them fit in a
+single thread. Run a quick check with ``python3 -m sim.network``.
+"""
+from .fabric import Fabric as Fabric
+from .network import Network as Network
@@ -0,0 +1,135 @@
+import math
+import random
+import traceback
+
+from common import Address, Event
+import common.btlxlogger as logger
+Logger = logger.get(__name__)
+
+
+class Fabric():
+    """
+    An in-memory datagram network.
+    Every datagram is delivered on the clock after a random latency,
+    or dropped with a fixed chance.
+    A few can be held up for much longer, to model a slow WAN tail.
+    In geographic mode every endpoint gets a random spot on a unit
+    square, and latency grows with the distance between the two ends.
+
+    .. attribute:: sent
+
+        Datagrams handed to the fabric.
+    .. attribute:: dropped
+
+        Datagrams lost on the way.
+    .. attribute:: bytes
+
+        Total bytes handed to the fabric.
+    """
+
+    def __init__(self, clock, latency=(0.01, 0.1), loss=0.0, rng=None,
+                 tail=(0.0, 0.0), geographic=False):
+        """
+        :param clock: The clock deliveries are scheduled on.
+        :type clock: :class:`~common.VirtualClock`
+        :param latency: Min and max one way latency, in seconds.
+        :type latency: (float, float)
+        :param loss: Chance of a datagram being dropped.
+        :type loss: float
+        :param rng: Source of randomness, for repeatable runs.
+        :type rng: :class:`random.Random`
+        :param tail: Chance of a datagram being held up,
+            and the extra seconds it is held for.
+        :type tail: (float, float)
+        :param geographic: Derive latency from endpoint positions
+            instead of drawing it for every datagram.
+        :type geographic: bool.
+        """
+        self.clock = clock
+        self.geographic = geographic
+        self.latency = latency
+        self.loss = loss
+        self.tail = tail
+        self.sent = 0
+        self.dropped = 0
+        self.bytes = 0
+        self._rng = rng if rng is not None else random.Random()
+        self._servers = {}  # {(ip, port): FabricServer}
+        self._spots = {}  # {(ip, port): (x, y)}
+
+    def server(self, address):
+        """
+        Attaches a new endpoint to the fabric.
+
+        :param address: The address it receives on.
+        :type address: :class:`~common.Address`
+        :rtype: :class:`~sim.fabric.FabricServer`
+        """
+        server = FabricServer(self, address)
+        self._servers[address.tuple] = server
+        self._spots[address.tuple] = (self._rng.random(), self._rng.random())
+        return server
+
+    def _latency(self, src, dst):
+        low, high = self.latency
+        if not self.geographic:
+            return self._rng.uniform(low, high)
+        (x1, y1), (x2, y2) = self._spots[src], self._spots[dst]
+        base = low + (high - low) * math.hypot(x1 - x2, y1 - y2) / math.sqrt(2)
+        # A little jitter on top of the path delay
+        return base * self._rng.uniform(0.9, 1.1)
+
+    def detach(self, address):
+        """
+        Removes an endpoint; datagrams to it are lost from then on.
+        """
+        self._servers.pop(address.tuple, None)
+
+    def send(self, src, dst, raw_data):
+        self.sent += 1
+        self.bytes += len(raw_data)
+        if self.loss > 0 and self._rng.random() < self.loss:
+            self.dropped += 1
+            return
+        delay = self._latency(src, dst)
+        if self.tail[0] > 0 and self._rng.random() < self.tail[0]:
+            delay += self.tail[1]
+        self.clock.call_later(delay, self._deliver, src, dst, raw_data)
+
+    def _deliver(self, src, dst, raw_data):
+        server = self._servers.get(dst)
+        if server is None:
+            self.dropped += 1
+            return
+        address = Address(*src)
+        try:
+            server.on_data(address, raw_data)
+        except:
+            Logger.error("----- Receive Error -----")
+            Logger.error("From: %s, Data: %s", address, raw_data)
+            Logger.error(traceback.format_exc())
+
+
+class FabricServer():
+    """
+    Drop-in for :class:`~net.udp.Server` on a :class:`~sim.fabric.Fabric`.
+
+    .. attribute:: on_data:
+        A tuple of (:class:`net.Address`, raw_data)
+    """
+
+    def __init__(self, fabric, address):
+        self.on_data = Event('fabric.server.on_data')
+        self.address = address
+        self._fabric = fabric
+
+    def send(self, address, raw_data):
+        """
+        Sends encoded data to an address.
+
+        :param address: The destination address
+        :type address: :attr:`~net.Address`
+        :param data: Raw data
+        :type tags: bytes
+        """
+        self._fabric.send(self.address.tuple, address.tuple, raw_data)
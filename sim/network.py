@@ -0,0 +1,199 @@
+"""
+Boots a network of simulated nodes and lets it settle.
+Each node joins through a random node that is already up,
+the way :func:`bytelynx_server.add_contact` does it by hand.
+"""
+import argparse
+import random
+import sys
+
+from common import Address, Contact, Hash, VirtualClock
+from kademlia import Kademlia
+from kademlia.constants import A, B, K
+from net import Stack
+from .fabric import Fabric
+
+#: Matches the default group in the config
+DH_GROUP = 7
+#: Port every simulated node listens on
+PORT = 7000
+#: Seconds of virtual time given to each join
+JOIN_SEC = 5
+
+
+class Node():
+    """
+    One simulated node.
+
+    .. attribute:: contact
+
+        The node's own :class:`~common.Contact`.
+    .. attribute:: net
+
+        The node's :class:`~net.Stack`.
+    .. attribute:: kademlia
+
+        The node's :class:`~kademlia.Kademlia`.
+    """
+
+    def __init__(self, network, address, hash_):
+        clock = network.clock
+        self.contact = Contact(address, hash_)
+        self.net = Stack(address.port, network.dh_group, hash_,
+                         network.fabric.server(address), clock)
+        self.kademlia = Kademlia(self.net, self.contact, None,
+                                 network.K, network.B, network.A, clock,
+                                 network.proximity)
+
+    def join(self, address):
+        """
+        Says hello to a known node and looks up our own hash
+        once it is in the buckets.
+
+        :param address: Address of the bootstrap node.
+        :type address: :class:`~common.Address`
+        """
+        contact = self.net._contacts.translate(address)
+        self.net.send_hello(contact)
+
+        def start_search(contact):
+            self.kademlia.buckets.on_added -= start_search
+            self.kademlia.init_search(self.contact.hash)
+        self.kademlia.buckets.on_added += start_search
+
+
+class Network():
+    """
+    A set of :class:`~sim.network.Node` on one
+    :class:`~sim.fabric.Fabric` and :class:`~common.VirtualClock`.
+
+    .. attribute:: nodes
+
+        All nodes, in the order they were added.
+    """
+
+    def __init__(self, K=K, B=B, A=A, latency=(0.01, 0.1), loss=0.0,
+                 seed=None, dh_group=DH_GROUP, tail=(0.0, 0.0),
+                 geographic=False, proximity=False):
+        """
+        :param K: Bucket size
+        :type K: int.
+        :param B: Key size
+        :type B: int.
+        :param A: Paralellism
+        :type A: int.
+        :param latency: Min and max one way latency, in seconds.
+        :type latency: (float, float)
+        :param loss: Chance of a datagram being dropped.
+        :type loss: float
+        :param seed: Seed for hashes, latency and loss.
+        :type seed: int.
+        :param tail: Chance of a datagram being held up,
+            and the extra seconds it is held for.
+        :type tail: (float, float)
+        :param geographic: Latency from node positions
+            (see :class:`~sim.fabric.Fabric`).
+        :type geographic: bool.
+        :param proximity: Run the nodes in proximity mode.
+        :type proximity: bool.
+        """
+        self.K = K
+        self.proximity = proximity
+        self.B = B
+        self.A = A
+        self.dh_group = dh_group
+        self.rng = random.Random(seed)
+        self.clock = VirtualClock()
+        self.fabric = Fabric(self.clock, latency, loss, self.rng, tail,
+                             geographic)
+        self.nodes = []
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def random_hash(self):
+        """
+        :rtype: :class:`~common.Hash`
+        """
+        return Hash.from_int(self.rng.getrandbits(self.B), self.B // 8)
+
+    def add_node(self, join=True):
+        """
+        Boots a new node, joining it through a random existing one.
+
+        :param join: Join the network right away.
+        :type join: bool.
+        :rtype: :class:`~sim.network.Node`
+        """
+        i = len(self.nodes) + 1
+        address = Address('10.%d.%d.%d' % (i >> 16, (i >> 8) & 255, i & 255),
+                          PORT)
+        node = Node(self, address, self.random_hash())
+        if join and len(self.nodes) > 0:
+            node.join(self.rng.choice(self.nodes).contact.address)
+        self.nodes.append(node)
+        return node
+
+    def grow(self, size, join_sec=JOIN_SEC):
+        """
+        Adds nodes one at a time until there are `size` of them,
+        giving each join some virtual time to finish.
+
+        :param size: Amount of nodes wanted.
+        :type size: int.
+        :param join_sec: Virtual seconds to run after each join.
+        :type join_sec: float
+        """
+        while len(self.nodes) < size:
+            self.add_node()
+            self.run(join_sec)
+
+    def run(self, seconds):
+        """
+        Runs the network for a span of virtual time.
+
+        :param seconds: Virtual seconds to run for.
+        :type seconds: float
+        """
+        self.clock.run(until=self.clock.time + seconds)
+
+    def wait(self, future, timeout=60):
+        """
+        Runs the network until a future is done.
+
+        :param future: A future from one of the nodes.
+        :type future: :class:`concurrent.futures.Future`
+        :param timeout: Most virtual seconds to run for.
+        :type timeout: float
+        :returns: If the future finished in time.
+        :rtype: bool.
+        """
+        self.clock.run(until=self.clock.time + timeout,
+                       predicate=future.done)
+        return future.done()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--nodes', type=int, default=50)
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--lookups', type=int, default=20)
+    args = parser.parse_args()
+
+    network = Network(loss=args.loss, seed=args.seed)
+    network.grow(args.nodes)
+    found = 0
+    for _ in range(args.lookups):
+        source, target = network.rng.sample(network.nodes, 2)
+        future = source.kademlia.init_search(target.contact.hash)
+        if network.wait(future) and future.result().found is not None:
+            found += 1
+    print('nodes: %d  virtual time: %.1fs  datagrams: %d (%d dropped)'
+          % (len(network), network.clock.time,
+             network.fabric.sent, network.fabric.dropped))
+    print('lookups found: %d / %d' % (found, args.lookups))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -58,11 +58,13 @@ class _State():
         from kademlia import Kademlia
         addr = Address(net.ipfinder.check_in(), port)
         self.contact = Contact(addr, hash_)
-        self.net = Stack(port, self.dh_group)
+        self.net = Stack(port, self.dh_group, hash_)
         self.kademlia = Kademlia(self.net, self.contact, self.dir,
                                  self.config['kademlia']['bucket_size'],
                                  self.bitsize,
-                                 self.config['kademlia']['paralellism'])
+                                 self.config['kademlia']['paralellism'],
+                                 proximity=self.config['kademlia'].get(
+                                     'proximity', False))
         try:
             from ui.server import UIServer
             self.uiserver = UIServer(self.config['net']['ui_port'],